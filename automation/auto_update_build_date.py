@@ -1,5 +1,14 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from urllib.parse import urlsplit
+
 from lxml import html
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 from dateutil.parser import parse, ParserError
 
@@ -66,11 +75,83 @@ def find_date(text):
         return None
 
 
-def parse_source(package_name, version):
+class PageFetcher:
+    """Fetch index pages over a pooled session.
+
+    Responses are cached on disk and revalidated using conditional requests
+    (``If-None-Match``/``If-Modified-Since``), hence unchanged pages are not downloaded again.
+    If ``mirror_dir`` is set, pages are read from ``<mirror_dir>/<host>/<path>/index.html``
+    instead (i.e. to run offline against fixtures).
+    """
+
+    def __init__(self, cache_dir=None, mirror_dir=None, pool_size=10, timeout=30):
+        self.cache_dir = cache_dir
+        self.mirror_dir = mirror_dir
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def mirror_path(self, url):
+        parts = urlsplit(url)
+        return os.path.join(self.mirror_dir, parts.netloc, parts.path.strip("/"), "index.html")
+
+    def cache_paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json"), os.path.join(self.cache_dir, f"{key}.html")
+
+    def fetch(self, url):
+        """Get content of the page."""
+        if self.mirror_dir:
+            with open(self.mirror_path(url), "rb") as f:
+                return f.read()
+
+        if not self.cache_dir:
+            page = self.session.get(url, timeout=self.timeout)
+            page.raise_for_status()
+            return page.content
+
+        meta_file, body_file = self.cache_paths(url)
+        headers = {}
+        try:
+            with open(meta_file) as f:
+                meta = json.loads(f.read())
+            with open(body_file, "rb") as f:
+                content = f.read()
+        except (FileNotFoundError, ValueError):
+            content = None
+        else:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        page = self.session.get(url, headers=headers, timeout=self.timeout)
+        if page.status_code == 304 and content is not None:
+            return content
+        page.raise_for_status()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write body before its validators, so validators never refer to stale body
+        with open(body_file, "wb") as f:
+            f.write(page.content)
+        with open(meta_file, "w") as f:
+            f.write(json.dumps({
+                "url": url,
+                "etag": page.headers.get("ETag"),
+                "last_modified": page.headers.get("Last-Modified"),
+            }))
+        return page.content
+
+
+def parse_source(package_name, version, fetcher=None):
     url = distributions_managed[package_name]["url"].format(version)
     package = distributions_managed[package_name]["source_package"].format(version)
-    page = requests.get(url)
-    tree = html.fromstring(page.content)
+    fetcher = fetcher or PageFetcher()
+    tree = html.fromstring(fetcher.fetch(url))
     a = '//a[@href="{}"] | //td'.format(package)
     table_rows = tree.xpath(a)
     temp_list = []
@@ -133,11 +214,27 @@ def update_build_date(dockerfile, old_build_date, new_build_date):
 
 
 def main():
-    dockerfile = Path("../Dockerfile")
+    parser = argparse.ArgumentParser(description="Update build date of Gluu packages in Dockerfile.")
+    parser.add_argument("--dockerfile", default="../Dockerfile", help="Path to Dockerfile (default: %(default)s)")
+    parser.add_argument("--mirror-dir", default=os.environ.get("AUTOMATION_MIRROR_DIR"),
+                        help="Read index pages from <dir>/<host>/<path>/index.html instead of network")
+    parser.add_argument("--cache-dir",
+                        default=os.environ.get("AUTOMATION_CACHE_DIR",
+                                               os.path.join(tempfile.gettempdir(), "gluu-build-date-cache")),
+                        help="Directory of cached index pages (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't cache index pages")
+    args = parser.parse_args()
+
+    dockerfile = Path(args.dockerfile)
     gluu_version_in_dockerfile, gluu_build_date_in_dockerfile, gluu_package_name_in_dockerfile = \
         find_current_gluu_package_version_and_build_date(dockerfile)
 
-    gluu_package_source_timestamp_string = parse_source(gluu_package_name_in_dockerfile, gluu_version_in_dockerfile)
+    fetcher = PageFetcher(cache_dir=None if args.no_cache else args.cache_dir, mirror_dir=args.mirror_dir)
+    gluu_package_source_timestamp_string = parse_source(
+        gluu_package_name_in_dockerfile, gluu_version_in_dockerfile, fetcher,
+    )
+    if not gluu_package_source_timestamp_string:
+        return
 
     if gluu_package_source_timestamp_string > gluu_build_date_in_dockerfile:
         update_build_date(dockerfile, gluu_build_date_in_dockerfile, gluu_package_source_timestamp_string)
@@ -0,0 +1,120 @@
+"""Minimal WebDAV server (``PROPFIND`` and ``GET`` only) standing in for Jackrabbit.
+
+Files are served from a local directory as if they were stored under ``/repository/default``;
+requests and bytes are counted per method, so each benchmark phase can report them.
+"""
+
+import email.utils
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import quote
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+ROOT_DIR = "/repository/default"
+
+
+class WebDAVHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # keep benchmark output clean
+        pass
+
+    def _local_path(self):
+        path = unquote(urlsplit(self.path).path)
+        if not path.startswith(ROOT_DIR):
+            return "", path
+        return os.path.join(self.server.root, path[len(ROOT_DIR):].lstrip("/")), path
+
+    def _props(self, local_path, href):
+        stat = os.stat(local_path)
+        modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+        if os.path.isdir(local_path):
+            # Jackrabbit doesn't provide etag of collection
+            props = f"<D:resourcetype><D:collection/></D:resourcetype><D:getlastmodified>{modified}</D:getlastmodified>"
+        else:
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            props = (
+                f"<D:resourcetype/><D:getetag>{etag}</D:getetag>"
+                f"<D:getlastmodified>{modified}</D:getlastmodified>"
+                f"<D:getcontentlength>{stat.st_size}</D:getcontentlength>"
+            )
+        return f"<D:response><D:href>{quote(href)}</D:href><D:propstat><D:prop>{props}</D:prop></D:propstat></D:response>"
+
+    def do_PROPFIND(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.server.record(self.command, received=len(self.rfile.read(length)))
+
+        local_path, path = self._local_path()
+        if not local_path or not os.path.exists(local_path):
+            self._send(404, b"")
+            return
+
+        responses = [self._props(local_path, path)]
+        if os.path.isdir(local_path) and self.headers.get("Depth", "infinity") != "0":
+            for name in sorted(os.listdir(local_path)):
+                child = os.path.join(local_path, name)
+                suffix = "/" if os.path.isdir(child) else ""
+                responses.append(self._props(child, f"{path.rstrip('/')}/{name}{suffix}"))
+
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?><D:multistatus xmlns:D="DAV:">'
+            + "".join(responses)
+            + "</D:multistatus>"
+        )
+        self._send(207, body.encode(), "text/xml; charset=utf-8")
+
+    def do_GET(self):
+        local_path, _ = self._local_path()
+        if not local_path or not os.path.isfile(local_path):
+            self._send(404, b"")
+            return
+
+        with open(local_path, "rb") as f:
+            self._send(200, f.read())
+
+    def _send(self, status, body, content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(self.command, sent=len(body))
+
+
+class WebDAVServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, host="127.0.0.1", port=0):
+        super().__init__((host, port), WebDAVHandler)
+        self.root = root
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, method, sent=0, received=0):
+        with self._lock:
+            if sent:
+                self.stats["requests"][method] = self.stats["requests"].get(method, 0) + 1
+            self.stats["bytes_sent"] += sent
+            self.stats["bytes_received"] += received
+
+    def reset_stats(self):
+        """Reset counters and return the previous ones."""
+        with self._lock:
+            stats = getattr(self, "stats", None)
+            self.stats = {"requests": {}, "bytes_sent": 0, "bytes_received": 0}
+        return stats
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
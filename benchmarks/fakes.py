@@ -0,0 +1,145 @@
+"""Stand-ins for config/secret backends and dependency probes."""
+
+import base64
+import datetime
+import json
+import os
+import threading
+import time
+
+
+class FakeAdapter:
+    """In-memory config/secret adapter that simulates backend latency.
+
+    The values are loaded from (and saved into) JSON file, hence they survive
+    between benchmark phases (i.e. sealer keystore pushed by cold start is
+    pulled by warm restart).
+    """
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self.calls = {"get": 0, "set": 0, "all": 0}
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                self.data = json.loads(f.read())
+        except FileNotFoundError:
+            self.data = {}
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        time.sleep(self.latency)
+
+    def get(self, key, default=None):
+        self._call("get")
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self._call("set")
+        self.data[key] = value
+        return True
+
+    def all(self):
+        self._call("all")
+        return dict(self.data)
+
+    def save(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.data))
+
+
+class FakeProbe:
+    """Dependency probe that succeeds after given number of attempts,
+    each of them takes ``latency`` seconds.
+    """
+
+    def __init__(self, latency=0.0, attempts=1):
+        self.latency = latency
+        self.attempts = attempts
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, manager):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+
+        time.sleep(self.latency)
+        if calls < self.attempts:
+            raise RuntimeError("dependency is not ready")
+
+
+def install_manager(manager, config_path, secret_path, latency):
+    """Replace adapters of ``manager`` with fake ones."""
+    manager.config.adapter = FakeAdapter(config_path, latency)
+    manager.secret.adapter = FakeAdapter(secret_path, latency)
+    return manager
+
+
+def _self_signed_cert(hostname):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        cert.public_bytes(serialization.Encoding.PEM).decode(),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ).decode(),
+    )
+
+
+def seed_backends(config_path, secret_path, hostname="bench.gluu.local"):
+    """Write config and secrets needed by bootstrap (for ``ldap`` persistence)."""
+    from pygluu.containerlib.utils import encode_text
+
+    salt = base64.b64encode(os.urandom(18)).decode()[:24]
+    cert, key = _self_signed_cert(hostname)
+
+    config = {
+        "hostname": hostname,
+        "orgName": "Benchmark",
+        "ldap_binddn": "cn=directory manager",
+        "ldapTrustStoreFn": "/etc/certs/opendj.pkcs12",
+        "couchbase_server_user": "admin",
+        "couchbaseTrustStoreFn": "/etc/certs/couchbase.pkcs12",
+    }
+    secrets = {
+        "encoded_salt": salt,
+        "shibJksPass": "secret",
+        "encoded_ox_ldap_pw": encode_text("secret", salt).decode(),
+        "encoded_ldapTrustStorePass": encode_text("secret", salt).decode(),
+        "idp3SigningCertificateText": cert,
+        "idp3SigningKeyText": key,
+        "idp3EncryptionCertificateText": cert,
+        "idp3EncryptionKeyText": key,
+        # the IdP keystore is only copied by bootstrap, not parsed
+        "shibIDP_jks_base64": base64.b64encode(b"benchmark").decode(),
+        "ssl_cert": cert,
+        "ldap_ssl_cert": encode_text(cert, salt).decode(),
+        "ldap_pkcs12_base64": encode_text(b"benchmark", salt).decode(),
+    }
+
+    for path, data in ((config_path, config), (secret_path, secrets)):
+        with open(path, "w") as f:
+            f.write(json.dumps(data))
@@ -0,0 +1,207 @@
+"""Run single benchmark phase against stand-in services; executed by ``run.py`` as child process
+(so each phase pays the interpreter and import cost like in the container, and has its own peak RSS).
+
+The phase result (duration and counters) is written as JSON into file given by ``--result``.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from fakes import FakeProbe
+from fakes import install_manager
+from fakes import seed_backends
+
+
+def _run_main(main):
+    try:
+        main()
+    except SystemExit as exc:
+        # main functions exit on failure
+        if exc.code:
+            raise
+
+
+def _patch_probes(args):
+    import wait
+
+    probes = {dep: FakeProbe(args.probe_latency, args.probe_attempts) for dep in wait.PROBES}
+    wait.PROBES.update(probes)
+    return probes
+
+
+def _fake_get_manager(args, managers):
+    from pygluu.containerlib import get_manager
+
+    def get_fake_manager():
+        manager = install_manager(
+            get_manager(),
+            os.path.join(args.workdir, "config.json"),
+            os.path.join(args.workdir, "secret.json"),
+            args.latency,
+        )
+        managers.append(manager)
+        return manager
+    return get_fake_manager
+
+
+def _backend_calls(managers):
+    calls = {}
+    for manager in managers:
+        for name, adapter in (("config", manager.config.adapter), ("secret", manager.secret.adapter)):
+            # prefetch wraps the fake adapter, but passes unknown attributes through
+            adapter.save()
+            for method, count in adapter.calls.items():
+                calls[f"{name}_{method}"] = calls.get(f"{name}_{method}", 0) + count
+    return calls
+
+
+def run_wait(args):
+    import wait
+
+    managers = []
+    probes = _patch_probes(args)
+    wait.get_manager = _fake_get_manager(args, managers)
+
+    started_at = time.perf_counter()
+    _run_main(wait.main)
+    return {
+        "duration": time.perf_counter() - started_at,
+        "backend_calls": _backend_calls(managers),
+        "probe_calls": sum(probe.calls for probe in probes.values()),
+    }
+
+
+def reset_bootstrap_state():
+    """Remove files which bootstrap only generates when missing, as in newly created container."""
+    from sealer import SEALER_JKS
+    from sealer import SEALER_KVER
+
+    for path in [
+        "/etc/certs/idp-signing.crt",
+        "/etc/certs/idp-signing.key",
+        "/etc/certs/idp-encryption.crt",
+        "/etc/certs/idp-encryption.key",
+        "/etc/certs/gluu_https.crt",
+        SEALER_JKS,
+        SEALER_KVER,
+        os.environ["GLUU_RENDER_DIGEST_FILE"],
+    ]:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+
+def take_sealer_files():
+    """Read and remove sealer files (pushed into secrets by cold start), so warm restart
+    has to pull them from secrets.
+
+    :returns: A ``dict`` of path and content of the files.
+    """
+    from sealer import SEALER_JKS
+    from sealer import SEALER_KVER
+
+    files = {}
+    for path in [SEALER_JKS, SEALER_KVER]:
+        with open(path, "rb") as f:
+            files[path] = f.read()
+        os.unlink(path)
+    return files
+
+
+def check_sealer_files(expected):
+    """Make sure sealer files pulled from secrets are identical to the pushed ones."""
+    for path, content in expected.items():
+        with open(path, "rb") as f:
+            if f.read() != content:
+                raise RuntimeError(f"{path} pulled from secrets differs from the pushed file")
+
+
+def run_bootstrap(args):
+    os.environ["GLUU_RENDER_DIGEST_FILE"] = os.path.join(args.workdir, "render-digests.json")
+    os.environ["GLUU_SSL_CERT_FROM_SECRETS"] = "true"
+
+    sealer_files = {}
+    if args.cold:
+        reset_bootstrap_state()
+        seed_backends(os.path.join(args.workdir, "config.json"), os.path.join(args.workdir, "secret.json"))
+    else:
+        sealer_files = take_sealer_files()
+
+    import bootstrap
+    import pygluu.containerlib
+
+    managers = []
+    probes = _patch_probes(args)
+    # bootstrap imports get_manager when it runs
+    pygluu.containerlib.get_manager = _fake_get_manager(args, managers)
+
+    started_at = time.perf_counter()
+    _run_main(bootstrap.run_bootstrap)
+    duration = time.perf_counter() - started_at
+
+    # round-trip of sealer files through secrets (push by cold start, pull by warm restart)
+    check_sealer_files(sealer_files)
+    return {
+        "duration": duration,
+        "backend_calls": _backend_calls(managers),
+        "probe_calls": sum(probe.calls for probe in probes.values()),
+    }
+
+
+def run_sync(args):
+    import jca_sync
+    import metadata
+
+    sync_dir = os.path.join(args.workdir, "local")
+    tmp_dir = os.path.join(args.workdir, "tmp")
+
+    jca_sync.SYNC_DIR = sync_dir
+    jca_sync.TMP_DIR = tmp_dir
+    jca_sync.MANIFEST_FILE = os.path.join(tmp_dir, ".manifest.json")
+    metadata.METADATA_DIR = os.path.join(sync_dir, "metadata")
+    metadata.PROVIDERS_FILE = os.path.join(sync_dir, "conf", "metadata-providers.xml")
+    metadata.INDEX_FILE = os.path.join(tmp_dir, ".metadata-index.json")
+    metadata.AGGREGATE_FILE = os.path.join(metadata.METADATA_DIR, "sp-metadata-aggregate.xml")
+    os.makedirs(metadata.METADATA_DIR, exist_ok=True)
+
+    started_at = time.perf_counter()
+
+    # a single cycle of the sync loop
+    client = jca_sync.get_client(args.url, "admin", "admin")
+    jca_sync.get_remote_fingerprint(client, sync_dir)
+    stats = jca_sync.sync_from_webdav(args.url, "admin", "admin")
+
+    return {
+        "duration": time.perf_counter() - started_at,
+        "sync": stats,
+    }
+
+
+PHASES = {
+    "wait": run_wait,
+    "bootstrap": run_bootstrap,
+    "sync": run_sync,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("phase", choices=sorted(PHASES))
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--result", required=True)
+    parser.add_argument("--url", default="")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--probe-latency", type=float, default=0.0)
+    parser.add_argument("--probe-attempts", type=int, default=1)
+    parser.add_argument("--cold", action="store_true")
+    args = parser.parse_args()
+
+    result = PHASES[args.phase](args)
+    with open(args.result, "w") as f:
+        f.write(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
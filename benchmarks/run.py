@@ -0,0 +1,229 @@
+"""Benchmark startup and sync of oxShibboleth container against local stand-in services.
+
+Each scenario runs a phase (see ``phases.py``) as child process and reports its wall time
+(including interpreter startup and imports), time spent in the phase itself, WebDAV requests,
+bytes moved, backend calls, and peak RSS.
+
+Sync scenarios only need the Python dependencies of ``scripts/jca_sync.py``; startup scenarios
+(``--startup``) modify files of the container, hence must run inside a disposable container.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from davserver import WebDAVServer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "scripts")
+
+METADATA_TMPL = """<?xml version="1.0" encoding="UTF-8"?>
+<md:EntityDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata" entityID="https://sp{index}.bench.local/shibboleth">
+    <!-- revision {revision} {padding} -->
+    <md:SPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+        <md:AssertionConsumerService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST" Location="https://sp{index}.bench.local/Shibboleth.sso/SAML2/POST" index="1"/>
+    </md:SPSSODescriptor>
+</md:EntityDescriptor>
+"""
+
+# metrics compared against baseline; times also have absolute slack to absorb noise (in seconds)
+COMPARED_METRICS = ("wall", "duration", "requests", "bytes", "peak_rss")
+TIME_SLACK = 0.05
+
+
+def write_metadata(remote_dir, index, size, revision=0):
+    content = METADATA_TMPL.format(index=index, revision=revision, padding="")
+    padding = "x" * max(size - len(content), 0)
+    with open(os.path.join(remote_dir, f"bench{index:05d}-sp-metadata.xml"), "w") as f:
+        f.write(METADATA_TMPL.format(index=index, revision=revision, padding=padding))
+
+
+def run_phase(phase, workdir, scripts_dir, server=None, **options):
+    """Run phase as child process.
+
+    :returns: A ``dict`` of metrics.
+    """
+    result_fn = os.path.join(workdir, "result.json")
+    cmd = [sys.executable, os.path.join(BENCHMARKS_DIR, "phases.py"), phase, "--workdir", workdir, "--result", result_fn]
+    for name, value in options.items():
+        if value is True:
+            cmd.append(f"--{name.replace('_', '-')}")
+        elif value not in (None, False):
+            cmd += [f"--{name.replace('_', '-')}", str(value)]
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([scripts_dir, BENCHMARKS_DIR]))
+
+    if server:
+        server.reset_stats()
+
+    started_at = time.perf_counter()
+    with open(os.path.join(workdir, f"{phase}.log"), "a") as log:
+        proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports resource usage of this child only
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    wall = time.perf_counter() - started_at
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"Phase {phase} failed; see {log.name}")
+
+    with open(result_fn) as f:
+        result = json.loads(f.read())
+
+    metrics = {
+        "wall": round(wall, 3),
+        "duration": round(result.pop("duration"), 3),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss": rusage.ru_maxrss * 1024,
+        "requests": 0,
+        "bytes": 0,
+    }
+    if server:
+        stats = server.reset_stats()
+        metrics["requests"] = sum(stats["requests"].values())
+        metrics["bytes"] = stats["bytes_sent"] + stats["bytes_received"]
+        metrics["requests_by_method"] = stats["requests"]
+    metrics.update(result)
+    return metrics
+
+
+def startup_scenarios(args, workdir):
+    options = {
+        "latency": args.latency,
+        "probe_latency": args.probe_latency,
+        "probe_attempts": args.probe_attempts,
+    }
+    yield "wait", run_phase("wait", workdir, args.scripts_dir, **options)
+    yield "bootstrap-cold", run_phase("bootstrap", workdir, args.scripts_dir, cold=True, **options)
+    yield "bootstrap-warm", run_phase("bootstrap", workdir, args.scripts_dir, **options)
+
+
+def sync_scenarios(args, workdir, count):
+    local_dir = os.path.join(workdir, "local")
+    remote_root = os.path.join(workdir, "remote")
+    # remote tree mirrors local sync directory, as in Jackrabbit
+    remote_dir = os.path.join(remote_root, local_dir.lstrip("/"), "metadata")
+    os.makedirs(remote_dir)
+
+    for index in range(count):
+        write_metadata(remote_dir, index, args.file_size)
+
+    server = WebDAVServer(remote_root).start()
+    try:
+        def sync():
+            return run_phase("sync", workdir, args.scripts_dir, server, url=server.url)
+
+        yield f"sync-initial-{count}", sync()
+        yield f"sync-unchanged-{count}", sync()
+
+        # make sure modification time (part of etag) is changed
+        time.sleep(0.01)
+        for index in range(0, count, 100):
+            write_metadata(remote_dir, index, args.file_size, revision=1)
+        yield f"sync-changed-{count}", sync()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_scenarios(args):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="oxshibboleth-bench-")
+
+    try:
+        if args.startup:
+            for name, metrics in startup_scenarios(args, workdir):
+                results[name] = metrics
+                print_row(name, metrics)
+
+        for count in args.sizes:
+            sync_workdir = os.path.join(workdir, f"sync-{count}")
+            os.makedirs(sync_workdir)
+            for name, metrics in sync_scenarios(args, sync_workdir, count):
+                results[name] = metrics
+                print_row(name, metrics)
+    finally:
+        if args.keep:
+            print(f"Kept working directory {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def print_header():
+    print(f"{'scenario':<24} {'wall (s)':>9} {'phase (s)':>9} {'requests':>9} {'bytes':>12} {'peak RSS (MiB)':>15}")
+
+
+def print_row(name, metrics):
+    print(
+        f"{name:<24} {metrics['wall']:>9.3f} {metrics['duration']:>9.3f} {metrics['requests']:>9} "
+        f"{metrics['bytes']:>12} {metrics['peak_rss'] / 1024 / 1024:>15.1f}",
+        flush=True,
+    )
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare results against baseline.
+
+    :returns: A ``list`` of regression messages.
+    """
+    regressions = []
+
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+
+        for metric in COMPARED_METRICS:
+            expected = baseline[name].get(metric)
+            if expected is None:
+                continue
+
+            limit = expected * (1 + tolerance)
+            if metric in ("wall", "duration"):
+                limit += TIME_SLACK
+
+            if metrics[metric] > limit:
+                regressions.append(f"{name}: {metric} {metrics[metric]} exceeds baseline {expected} (limit {limit:g})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated number of SP metadata files (default: %(default)s)")
+    parser.add_argument("--file-size", type=int, default=4096, help="Size of each SP metadata file in bytes (default: %(default)s)")
+    parser.add_argument("--startup", action="store_true", help="Include wait and bootstrap scenarios (inside disposable container only)")
+    parser.add_argument("--latency", type=float, default=0.005, help="Latency of each config/secret call in seconds (default: %(default)s)")
+    parser.add_argument("--probe-latency", type=float, default=0.05, help="Latency of each dependency probe in seconds (default: %(default)s)")
+    parser.add_argument("--probe-attempts", type=int, default=1, help="Attempts until each dependency is ready (default: %(default)s)")
+    parser.add_argument("--scripts-dir", default=SCRIPTS_DIR, help="Directory of container scripts (default: %(default)s)")
+    parser.add_argument("--output", help="Save results as JSON into this file")
+    parser.add_argument("--baseline", help="Compare results against JSON file saved by --output")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative increase over baseline (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="Keep working directory (logs, synced files) after run")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    print_header()
+    results = run_scenarios(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.loads(f.read()), args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
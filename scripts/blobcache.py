@@ -0,0 +1,141 @@
+"""Content-addressed cache of synced files, bounded by size (least recently used blobs are evicted).
+
+The cache directory can be mounted as a volume (or shared ``emptyDir``), hence synced files
+are restored from the cache after restart instead of downloaded again. Layout of the directory:
+
+- ``manifest.json``: properties (and digest) of remote files recorded in previous sync
+- ``blobs/sha256/<first 2 characters of digest>/<digest>``: content of each file
+
+Blobs are immutable and written atomically, so other processes can read them directly.
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+
+from utils import atomic_path
+from utils import file_digest
+
+logger = logging.getLogger("webdav")
+
+
+def get_cache_dir():
+    return os.environ.get("GLUU_JACKRABBIT_SYNC_CACHE_DIR", "")
+
+
+def get_cache_size():
+    """Get maximum size of cache in bytes."""
+    try:
+        size = int(os.environ.get("GLUU_JACKRABBIT_SYNC_CACHE_SIZE", 512))
+    except ValueError:
+        size = 512
+    return max(size, 1) * 1024 * 1024
+
+
+class BlobCache:
+    """Store of file content keyed by its SHA-256 digest."""
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs", "sha256")
+        self.max_size = max_size
+        self.stored = False
+
+    def path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def put(self, src, digest):
+        """Store copy of file as blob (unless exists)."""
+        path = self.path(digest)
+        if os.path.isfile(path):
+            self._touch(path)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{digest}.")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+        self.stored = True
+
+    def restore(self, digest, local_path, validate=None):
+        """Publish blob into local path atomically.
+
+        :param validate: Optional callable to check the (temporary) file before publishing.
+        :returns: Whether local file is replaced, i.e. ``False`` if local file already has
+                  the same digest, or ``None`` if the blob is missing or corrupted
+                  (its content doesn't match the digest) hence cannot be restored.
+        """
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            return None
+
+        if file_digest(path) != digest:
+            logger.warning(f"Removing corrupted blob {path}")
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            return None
+
+        if file_digest(local_path) == digest:
+            self._touch(path)
+            return False
+
+        with atomic_path(local_path) as result:
+            shutil.copyfile(path, result["path"])
+            if validate:
+                validate(result["path"])
+
+        self._touch(path)
+        return True
+
+    def _touch(self, path):
+        # modification time is used as last access time for eviction
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+
+    def evict(self, referenced=()):
+        """Remove least recently used blobs until the cache fits into its maximum size;
+        blobs not referenced by the manifest are removed first.
+
+        :returns: Number of removed blobs.
+        """
+        blobs = []
+        total = 0
+        for entry in os.scandir(self.blob_dir) if os.path.isdir(self.blob_dir) else []:
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                if blob.name.startswith("."):
+                    continue
+                stat = blob.stat()
+                total += stat.st_size
+                blobs.append((blob.name in referenced, stat.st_mtime, stat.st_size, blob.path))
+
+        removed = 0
+        for _, _, size, path in sorted(blobs):
+            if total <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} blob(s) from {self.root}; cache size is {total} bytes")
+        self.stored = False
+        return removed
+
+
+def get_blob_cache():
+    """Get cache in ``GLUU_JACKRABBIT_SYNC_CACHE_DIR`` (if set)."""
+    root = get_cache_dir()
+    if not root:
+        return None
+    return BlobCache(root, get_cache_size())
@@ -0,0 +1,261 @@
+"""Single entry point of container commands.
+
+Usage (with ``/app/scripts`` in ``PYTHONPATH``): ``python3 -m bootstrap [COMMAND] [ARGS...]``
+
+- ``bootstrap`` (default): wait for dependencies and run bootstrap steps as a dependency graph
+- ``start``: run bootstrap, then replace the process with the IdP (Jetty)
+- ``wait``, ``sync``, ``jvm-options``, ``cds``, ``sealer``, ``patch``, ``notify``: same as running
+  ``wait.py``, ``jca_sync.py``, ``jvm.py``, ``cds.py``, ``sealer.py``, ``patch.py``, or ``watch.py notify``
+- ``imports [COMMAND]``: report import time of modules loaded by the command (based on ``-X importtime``)
+
+Each bootstrap step starts as soon as its required steps (or backends) are ready, so steps which only need
+config and secrets (i.e. rendering templates) run while waiting for LDAP/Couchbase.
+
+Modules are imported only by the command that needs them, hence commands which don't talk
+to config/secret backends never load ``pygluu.containerlib`` (and its adapters); ``bootstrap`` and ``start``
+load it in full through ``entrypoint``, as every persistence helper is re-exported by its ``persistence`` package.
+"""
+
+import importlib
+import logging.config
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from settings import LOGGING_CONFIG
+
+logging.config.dictConfig(LOGGING_CONFIG)
+logger = logging.getLogger("entrypoint")
+
+# commands implemented by other scripts; a tuple of module name and its leading arguments
+DELEGATED_COMMANDS = {
+    "wait": ("wait", []),
+    "sync": ("jca_sync", []),
+    "jvm-options": ("jvm", []),
+    "cds": ("cds", []),
+    "sealer": ("sealer", []),
+    "patch": ("patch", []),
+    "notify": ("watch", ["notify"]),
+}
+
+# modules loaded by each command (used by import report)
+COMMAND_MODULES = {
+    "bootstrap": ["bootstrap", "entrypoint", "wait"],
+    "start": ["bootstrap", "entrypoint", "wait", "jvm", "cds", "instrumentation"],
+    **{command: ["bootstrap", module] for command, (module, _) in DELEGATED_COMMANDS.items()},
+}
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+class StepError(Exception):
+    """Raised when bootstrap step fails or cannot be scheduled."""
+
+
+def get_readiness_steps(deps):
+    """Get steps to wait for each dependency, named after the dependency itself.
+
+    In ``serial`` mode (``GLUU_WAIT_MODE``), each step requires the previous one,
+    so dependencies are checked one after another (as ``wait.py`` does).
+    """
+    from wait import get_wait_interval
+    from wait import get_wait_max_time
+    from wait import get_wait_mode
+    from wait import wait_for_dependency
+
+    if get_wait_mode() == "serial":
+        from pygluu.containerlib import wait_for
+
+        def serial_step(dep):
+            return lambda manager: wait_for(manager, [dep])
+
+        return [(dep, serial_step(dep), [deps[index - 1]] if index else []) for index, dep in enumerate(deps)]
+
+    deadline = time.monotonic() + get_wait_max_time()
+    max_interval = get_wait_interval()
+
+    def readiness_step(dep):
+        return lambda manager: wait_for_dependency(manager, dep, deadline, max_interval)
+
+    return [(dep, readiness_step(dep), []) for dep in deps]
+
+
+def run_steps(manager, steps, timer):
+    """Run each step as soon as its required steps are finished; independent steps run in parallel.
+
+    Once a step fails, no more steps are started and :class:`StepError` is raised
+    after running steps are finished.
+    """
+    pending = {name: (func, set(requires)) for name, func, requires in steps}
+
+    for name, (_, requires) in pending.items():
+        missing = requires - set(pending)
+        if missing:
+            raise StepError(f"Step {name} requires unknown step(s) {', '.join(sorted(missing))}")
+
+    def run_step(name, func):
+        with timer.step(name):
+            func(manager)
+
+    done = set()
+    running = {}
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        while pending or running:
+            if not errors:
+                for name, (func, requires) in list(pending.items()):
+                    if requires <= done:
+                        running[executor.submit(run_step, name, func)] = name
+                        del pending[name]
+
+            if not running:
+                if not errors:
+                    errors.append(f"circular requirements between {', '.join(sorted(pending))}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as exc:
+                    logger.error(f"Step {name} failed; reason={exc}")
+                    errors.append(f"{name} ({exc})")
+                else:
+                    done.add(name)
+
+    if errors:
+        raise StepError(f"Bootstrap failed: {'; '.join(errors)}")
+
+
+def run_bootstrap():
+    from pygluu.containerlib import get_manager
+    from pygluu.containerlib.validators import validate_persistence_type
+    from pygluu.containerlib.validators import validate_persistence_ldap_mapping
+
+    from entrypoint import get_bootstrap_steps
+    from metrics import StepTimer
+    from metrics import get_textfile_path
+    from metrics import write_textfile
+    from wait import get_dependencies
+
+    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
+    validate_persistence_type(persistence_type)
+
+    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
+    validate_persistence_ldap_mapping(persistence_type, ldap_mapping)
+
+    started_at = time.monotonic()
+    timer = StepTimer("oxshibboleth_bootstrap_step_duration_seconds")
+
+    with timer.step("get_manager"):
+        manager = get_manager()
+
+    steps = get_readiness_steps(get_dependencies(persistence_type))
+    steps += get_bootstrap_steps(persistence_type, ldap_mapping)
+
+    try:
+        run_steps(manager, steps, timer)
+    except StepError as exc:
+        logger.error(exc)
+        sys.exit(1)
+    finally:
+        textfile = get_textfile_path("oxshibboleth_bootstrap")
+        if textfile:
+            write_textfile(textfile)
+
+    timer.report(logger)
+    logger.info(f"Bootstrap finished in {time.monotonic() - started_at:.3f}s")
+
+
+def start():
+    """Run bootstrap and the IdP in the same process (no extra interpreters for JVM/CDS options)."""
+    run_bootstrap()
+
+    from cds import get_cds_mode
+    from cds import get_cds_options
+    from cds import train
+    from instrumentation import get_instrumentation_options
+    from jvm import get_java_command
+    from jvm import get_jvm_options
+
+    cmd = get_java_command(get_jvm_options() + get_cds_options() + get_instrumentation_options())
+    os.chdir("/opt/gluu/jetty/idp")
+
+    if get_cds_mode() == "train":
+        # run the IdP until it's ready, then create class data sharing archive and exit
+        sys.exit(0 if train(cmd) else 1)
+
+    logging.shutdown()
+    os.execvp(cmd[0], cmd)
+
+
+def run_delegated(command, args):
+    module_name, leading_args = DELEGATED_COMMANDS[command]
+    module = importlib.import_module(module_name)
+
+    # the script parses its own arguments
+    sys.argv = [f"{module_name}.py"] + leading_args + args
+    module.main()
+
+
+def report_imports(command, top=15):
+    """Print import time of modules loaded by the command, grouped by top-level package."""
+    import subprocess
+
+    modules = COMMAND_MODULES[command]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")]))
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {module}" for module in modules)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else f"Unable to import {', '.join(modules)}")
+        sys.exit(1)
+
+    packages = defaultdict(int)
+    total = 0
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, _, _, name = match.groups()
+        packages[name.split(".")[0]] += int(self_us)
+        total += int(self_us)
+
+    print(f"Importing {', '.join(modules)} took {total / 1000:.1f} ms")
+    print(f"{'package':<32} {'self (ms)':>10} {'share':>7}")
+    for name, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{name:<32} {self_us / 1000:>10.1f} {self_us / max(total, 1):>7.1%}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "bootstrap"
+    args = sys.argv[2:]
+
+    if command == "bootstrap":
+        run_bootstrap()
+    elif command == "start":
+        start()
+    elif command in DELEGATED_COMMANDS:
+        run_delegated(command, args)
+    elif command == "imports" and (args[0] if args else "start") in COMMAND_MODULES:
+        report_imports(args[0] if args else "start")
+    else:
+        logger.error(f"Usage: python3 -m bootstrap [{'|'.join(['bootstrap', 'start', 'imports', *DELEGATED_COMMANDS])}] [ARGS...]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
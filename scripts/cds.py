@@ -0,0 +1,216 @@
+"""Manage class data sharing (AppCDS) archive to speed up JVM startup.
+
+Usage:
+
+- ``python3 /app/scripts/cds.py options``: print JVM options to use (or record) the archive.
+- ``python3 /app/scripts/cds.py train java [ARGS...]``: run the given command until the IdP is ready,
+  then create the archive from classes loaded so far.
+
+Note that Java 11 only archives classes loaded by the built-in class loaders (JDK and ``start.jar``);
+classes of the IdP webapp are loaded by Jetty's webapp class loader, hence are not archived.
+"""
+
+import contextlib
+import glob
+import logging.config
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from settings import LOGGING_CONFIG
+from utils import file_digest
+from utils import text_digest
+
+logger = logging.getLogger("entrypoint")
+
+# classpath of ``java -jar /opt/jetty/start.jar``; must match at dump and runtime
+CLASSPATH = "/opt/jetty/start.jar"
+WAR_MANIFEST = "/opt/gluu/jetty/idp/webapps/idp/META-INF/MANIFEST.MF"
+JAVA_RELEASE = "/usr/lib/jvm/default-jvm/release"
+
+# files of other keys (or leftovers of other processes) are removed only after they're unused for this long,
+# as the directory may be shared by pods of another image version (i.e. during rolling deploy)
+STALE_AGE = 24 * 60 * 60
+
+
+def get_cds_mode():
+    mode = os.environ.get("GLUU_CDS_MODE", "off")
+    if mode not in ("off", "auto", "train"):
+        mode = "off"
+    return mode
+
+
+def get_cds_dir():
+    return os.environ.get("GLUU_CDS_DIR", "/deploy/cds")
+
+
+def get_archive_key():
+    """Get key of archive that changes whenever IdP, JDK, or image build changes."""
+    return text_digest(
+        os.environ.get("GLUU_VERSION", ""),
+        os.environ.get("GLUU_BUILD_DATE", ""),
+        file_digest(WAR_MANIFEST),
+        file_digest(JAVA_RELEASE),
+        file_digest(CLASSPATH),
+    )[:16]
+
+
+def get_training_timeout():
+    try:
+        timeout = int(os.environ.get("GLUU_CDS_TRAINING_TIMEOUT", 600))
+    except ValueError:
+        timeout = 600
+    return max(timeout, 1)
+
+
+def get_tmp_suffix(pid=True):
+    """Get suffix of temporary files owned by this container (and process), so pods sharing
+    the directory never write into each other's files.
+    """
+    if pid:
+        return f".{socket.gethostname()}-{os.getpid()}.tmp"
+    return f".{socket.gethostname()}.tmp"
+
+
+def get_paths():
+    """Get paths to class list and archive for current key; stale files are removed."""
+    cds_dir = get_cds_dir()
+    os.makedirs(cds_dir, exist_ok=True)
+
+    prefix = os.path.join(cds_dir, f"idp-{get_archive_key()}")
+    classlist, archive = f"{prefix}.classlist", f"{prefix}.jsa"
+
+    now = time.time()
+    for path in glob.glob(os.path.join(cds_dir, "idp-*")):
+        if path in (classlist, archive):
+            continue
+        try:
+            if now - os.stat(path).st_mtime < STALE_AGE:
+                continue
+            logger.info(f"Removing stale CDS file {path}")
+            os.unlink(path)
+        except FileNotFoundError:
+            # removed by another pod
+            continue
+    return classlist, archive
+
+
+def dump_archive(classlist, archive):
+    """Create archive from class list.
+
+    :returns: Whether the archive is created.
+    """
+    tmp_archive = f"{archive}{get_tmp_suffix()}"
+    started_at = time.monotonic()
+
+    proc = subprocess.run(
+        [
+            "java",
+            "-Xshare:dump",
+            f"-XX:SharedClassListFile={classlist}",
+            f"-XX:SharedArchiveFile={tmp_archive}",
+            "-cp",
+            CLASSPATH,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+
+    if proc.returncode != 0 or not os.path.isfile(tmp_archive):
+        logger.warning(f"Unable to create CDS archive; reason={proc.stdout.decode(errors='replace')[-1000:]}")
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_archive)
+        # the class list is likely corrupted, hence record a new one on next start
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(classlist)
+        return False
+
+    os.replace(tmp_archive, archive)
+    logger.info(f"Created CDS archive {archive} in {time.monotonic() - started_at:.3f}s")
+    return True
+
+
+def get_cds_options():
+    """Get JVM options to use the archive if exists; otherwise, options to record
+    loaded classes (so the archive is created on next start).
+    """
+    if get_cds_mode() != "auto":
+        return []
+
+    classlist, archive = get_paths()
+    # classes loaded by previous start of this container; the JVM has exited, hence the list is complete
+    recorded_classlist = f"{classlist}{get_tmp_suffix(pid=False)}"
+
+    if not os.path.isfile(classlist) and os.path.isfile(recorded_classlist):
+        os.replace(recorded_classlist, classlist)
+
+    if not os.path.isfile(archive) and os.path.isfile(classlist):
+        dump_archive(classlist, archive)
+
+    if os.path.isfile(archive):
+        logger.info(f"Using CDS archive {archive}")
+        # fallback to normal class loading if archive is unusable
+        return ["-Xshare:auto", f"-XX:SharedArchiveFile={archive}"]
+
+    logger.info(f"Recording loaded classes into {recorded_classlist}; CDS archive will be created on next start")
+    return [f"-XX:DumpLoadedClassList={recorded_classlist}"]
+
+
+def wait_until_ready(proc, url, timeout):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return True
+        except Exception:
+            time.sleep(5)
+    return False
+
+
+def train(cmd):
+    """Run the command while recording loaded classes until IdP is ready, then create the archive."""
+    classlist, archive = get_paths()
+    tmp_classlist = f"{classlist}{get_tmp_suffix()}"
+
+    url = os.environ.get("GLUU_CDS_TRAINING_URL", "http://localhost:8080/idp/status")
+    timeout = get_training_timeout()
+
+    proc = subprocess.Popen([cmd[0], f"-XX:DumpLoadedClassList={tmp_classlist}"] + cmd[1:])
+    try:
+        if wait_until_ready(proc, url, timeout):
+            logger.info(f"IdP is ready at {url}")
+        else:
+            logger.warning(f"IdP is not ready at {url}; creating CDS archive from classes loaded so far")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    if not os.path.isfile(tmp_classlist):
+        logger.error("Unable to find list of loaded classes")
+        return False
+
+    os.replace(tmp_classlist, classlist)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(archive)
+    return dump_archive(classlist, archive)
+
+
+def main():
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "options":
+        print(" ".join(get_cds_options()))
+    elif command == "train" and len(sys.argv) > 2:
+        sys.exit(0 if train(sys.argv[2:]) else 1)
+    else:
+        logger.error("Usage: cds.py options|train java [ARGS...]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
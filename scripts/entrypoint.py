@@ -1,6 +1,6 @@
 import glob
+import logging.config
 import os
-import re
 
 from pygluu.containerlib import get_manager
 from pygluu.containerlib.persistence import render_hybrid_properties
@@ -12,14 +12,42 @@ from pygluu.containerlib.persistence import render_ldap_properties
 from pygluu.containerlib.persistence import sync_ldap_truststore
 from pygluu.containerlib.persistence.couchbase import get_couchbase_mappings
 from pygluu.containerlib.utils import decode_text
-from pygluu.containerlib.utils import exec_cmd
 from pygluu.containerlib.utils import safe_render
 from pygluu.containerlib.utils import cert_to_truststore
 from pygluu.containerlib.utils import get_server_certificate
 from pygluu.containerlib.utils import as_boolean
 
+from metrics import StepTimer
+from metrics import get_textfile_path
+from metrics import write_textfile
+from instrumentation import configure_instrumentation
+from instrumentation import is_instrumentation_enabled
+from keystore import UnsupportedKeystoreError
+from keystore import import_trusted_certs
+from keystore import pkcs12_has_cert
+from patch import get_file_patches
+from patch import patch_file
+from prefetch import prefetch
+from sealer import SEALER_JKS
+from sealer import SEALER_KVER
+from sealer import pull_sealer
+from sealer import push_sealer
+from sealer import rotate_sealer
+from settings import LOGGING_CONFIG
+from sizing import get_pool_sizes
+from utils import atomic_write
+from utils import get_digest_store
+from utils import render_template
+from utils import render_with
+
+logging.config.dictConfig(LOGGING_CONFIG)
+logger = logging.getLogger("entrypoint")
+
 GLUU_LDAP_URL = os.environ.get("GLUU_LDAP_URL", "localhost:1636")
 GLUU_COUCHBASE_URL = os.environ.get("GLUU_COUCHBASE_URL", "localhost")
+GLUU_COUCHBASE_CERT_FILE = os.environ.get("GLUU_COUCHBASE_CERT_FILE", "/etc/certs/couchbase.crt")
+
+JAVA_CACERTS = "/usr/lib/jvm/default-jvm/jre/lib/security/cacerts"
 
 
 def render_idp3_templates(manager):
@@ -29,10 +57,13 @@ def render_idp3_templates(manager):
     ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
 
     idp_resolver_filter = "(|(uid=$requestContext.principalName)(mail=$requestContext.principalName))"
+    # rendered as part of idp.properties (rather than patched afterwards), so the render digest stays valid
+    idp_additional_properties = ""
 
     if all([persistence_type in ("couchbase", "hybrid"),
             "user" in get_couchbase_mappings(persistence_type, ldap_mapping)]):
         idp_resolver_filter = "(&(|(lower(uid)=$requestContext.principalName)(mail=$requestContext.principalName))(objectClass=gluuPerson))"
+        idp_additional_properties = ", /conf/datasource.properties"
 
     bucket_prefix = os.environ.get("GLUU_COUCHBASE_BUCKET_PREFIX", "gluu")
 
@@ -55,22 +86,22 @@ def render_idp3_templates(manager):
         "couchbase_n1ql_port": 18093 if as_boolean(os.environ.get("GLUU_COUCHBASE_TRUSTSTORE_ENABLE", True)) else 8093,
         "couchbaseShibUserPassword": manager.secret.get("couchbase_shib_user_password"),
         "idp_attribute_resolver_ldap.search_filter": idp_resolver_filter,
+        "idp_additional_properties": idp_additional_properties,
         "user_bucket": f"{bucket_prefix}_user"
     }
+    ctx.update(get_pool_sizes())
+
+    digest_store = get_digest_store()
 
     for file_path in glob.glob("/app/templates/idp3/*.properties"):
-        with open(file_path) as fr:
-            rendered_content = safe_render(fr.read(), ctx)
-            fn = os.path.basename(file_path)
-            with open("/opt/shibboleth-idp/conf/{}".format(fn), 'w') as fw:
-                fw.write(rendered_content)
+        fn = os.path.basename(file_path)
+        render_template(file_path, "/opt/shibboleth-idp/conf/{}".format(fn), ctx, digest_store, safe_render)
 
     file_path = "/app/templates/idp3/idp-metadata.xml"
-    with open(file_path) as fr:
-        rendered_content = safe_render(fr.read(), ctx)
-        fn = os.path.basename(file_path)
-        with open("/opt/shibboleth-idp/metadata/{}".format(fn), 'w') as fw:
-            fw.write(rendered_content)
+    fn = os.path.basename(file_path)
+    render_template(file_path, "/opt/shibboleth-idp/metadata/{}".format(fn), ctx, digest_store, safe_render)
+
+    digest_store.save()
 
 
 def load_cert_text(path):
@@ -79,110 +110,78 @@ def load_cert_text(path):
         return cert.replace('-----BEGIN CERTIFICATE-----', '').replace('-----END CERTIFICATE-----', '').strip()
 
 
-def generate_idp3_sealer(manager):
-    cmd = " ".join([
-        "java",
-        "-classpath '/opt/gluu/jetty/idp/webapps/idp/WEB-INF/lib/*'",
-        "net.shibboleth.utilities.java.support.security.BasicKeystoreKeyStrategyTool",
-        "--storefile /opt/shibboleth-idp/credentials/sealer.jks",
-        "--versionfile /opt/shibboleth-idp/credentials/sealer.kver",
-        "--alias secret",
-        "--storepass {}".format(manager.secret.get("shibJksPass")),
-    ])
-    return exec_cmd(cmd)
-
-
 def sync_sealer(manager):
-    jks_fn = "/opt/shibboleth-idp/credentials/sealer.jks"
-    kver_fn = "/opt/shibboleth-idp/credentials/sealer.kver"
-
-    if all([os.path.isfile(jks_fn), os.path.isfile(kver_fn)]):
+    if all([os.path.isfile(SEALER_JKS), os.path.isfile(SEALER_KVER)]):
         return
 
     # files are missing, get them from secrets (if any) or generate new ones
-    try:
-        manager.secret.to_file("sealer_jks_base64", jks_fn, decode=True, binary_mode=True)
-        manager.secret.to_file("sealer_kver_base64", kver_fn, decode=True, binary_mode=True)
-    except TypeError:
-        generate_idp3_sealer(manager)
-        manager.secret.from_file("sealer_jks_base64", jks_fn, encode=True, binary_mode=True)
-        manager.secret.from_file("sealer_kver_base64", kver_fn, encode=True, binary_mode=True)
-
-
-def modify_jetty_xml():
-    fn = "/opt/jetty/etc/jetty.xml"
-    with open(fn) as f:
-        txt = f.read()
-
-    # disable contexts
-    updates = re.sub(
-        r'<New id="DefaultHandler" class="org.eclipse.jetty.server.handler.DefaultHandler"/>',
-        r'<New id="DefaultHandler" class="org.eclipse.jetty.server.handler.DefaultHandler">\n\t\t\t\t <Set name="showContexts">false</Set>\n\t\t\t </New>',
-        txt,
-        flags=re.DOTALL | re.M,
-    )
-
-    # disable Jetty version info
-    updates = re.sub(
-        r'(<Set name="sendServerVersion"><Property name="jetty.httpConfig.sendServerVersion" deprecated="jetty.send.server.version" default=")true(" /></Set>)',
-        r'\1false\2',
-        updates,
-        flags=re.DOTALL | re.M,
-    )
+    if not pull_sealer(manager):
+        rotate_sealer(SEALER_JKS, SEALER_KVER, manager.secret.get("shibJksPass"))
+        push_sealer(manager)
 
-    with open(fn, "w") as f:
-        f.write(updates)
 
+def sync_java_truststore(persistence_type):
+    # merge all certs into JDK truststore in one pass, without launching keytool
+    certs = {"gluu_https": "/etc/certs/gluu_https.crt"}
 
-def modify_webdefault_xml():
-    fn = "/opt/jetty/etc/webdefault.xml"
-    with open(fn) as f:
-        txt = f.read()
+    if persistence_type in ("ldap", "hybrid"):
+        certs["opendj"] = "/etc/certs/opendj.crt"
 
-    # disable dirAllowed
-    updates = re.sub(
-        r'(<param-name>dirAllowed</param-name>)(\s*)(<param-value>)true(</param-value>)',
-        r'\1\2\3false\4',
-        txt,
-        flags=re.DOTALL | re.M,
-    )
+    if persistence_type in ("couchbase", "hybrid") and os.path.isfile(GLUU_COUCHBASE_CERT_FILE):
+        certs["couchbase"] = GLUU_COUCHBASE_CERT_FILE
 
-    with open(fn, "w") as f:
-        f.write(updates)
+    try:
+        imported = import_trusted_certs(JAVA_CACERTS, "changeit", certs)
+    except UnsupportedKeystoreError:
+        # i.e. PKCS12 truststore; fallback to keytool
+        logger.warning(f"Unable to import certs into {JAVA_CACERTS} natively; using keytool instead")
+        for alias, cert_fn in certs.items():
+            cert_to_truststore(alias, cert_fn, JAVA_CACERTS, "changeit")
+        return
 
+    if imported:
+        logger.info(f"Imported {', '.join(imported)} cert(s) into {JAVA_CACERTS}")
+    else:
+        logger.info(f"All certs are already trusted by {JAVA_CACERTS}")
 
-def saml_couchbase_settings():
-    # Add couchbase bean to global.xml
-    global_xml_fn = "/opt/shibboleth-idp/conf/global.xml"
-    with open(global_xml_fn) as f:
-        global_xml = f.read()
 
-    with open("/app/static/couchbase_bean.xml") as f:
-        bean_xml = f.read()
+def couchbase_truststore_synced(manager):
+    """Check whether Couchbase truststore already contains the Couchbase cert,
+    so the truststore can be used as-is without launching keytool.
+    """
+    truststore_fn = manager.config.get("couchbaseTrustStoreFn")
+    if not all([truststore_fn, os.path.isfile(truststore_fn), os.path.isfile(GLUU_COUCHBASE_CERT_FILE)]):
+        return False
 
-    with open(global_xml_fn, "w") as f:
-        global_xml = global_xml.replace("</beans>", bean_xml + "\n\n</beans>")
-        f.write(global_xml)
+    try:
+        return pkcs12_has_cert(
+            truststore_fn,
+            manager.secret.get("couchbase_truststore_pw") or "",
+            GLUU_COUCHBASE_CERT_FILE,
+        )
+    except (ImportError, TypeError, ValueError) as exc:
+        logger.warning(f"Unable to check certs in {truststore_fn}; reason={exc}")
+        return False
 
-    # Add datasource.properties to idp.properties
-    idp_properties_fn = "/opt/shibboleth-idp/conf/idp.properties"
-    with open(idp_properties_fn) as f:
-        idp3_properties = f.readlines()
 
-    for i, l in enumerate(idp3_properties):
-        if l.strip().startswith('idp.additionalProperties'):
-            idp3_properties[i] = l.strip() + ', /conf/datasource.properties\n'
+def patch_files(couchbase_user=False):
+    for path, edits in get_file_patches(couchbase_user, is_instrumentation_enabled()):
+        patch_file(path, edits)
 
-    with open(idp_properties_fn, "w") as f:
-        new_idp3_props = ''.join(idp3_properties)
-        f.write(new_idp3_props)
 
+def render_jetty_threadpool():
+    sizes = get_pool_sizes()
+    changed = atomic_write(
+        "/opt/gluu/jetty/idp/start.d/threadpool-sizing.ini",
+        "# generated by entrypoint based on container limits\n"
+        f"jetty.threadPool.minThreads={sizes['jetty_threadpool_min']}\n"
+        f"jetty.threadPool.maxThreads={sizes['jetty_threadpool_max']}\n",
+    )
+    if changed:
+        logger.info("Updated Jetty threadpool size")
 
-def main():
-    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
-    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
-    manager = get_manager()
 
+def sync_idp_certs(manager):
     if not os.path.isfile("/etc/certs/idp-signing.crt"):
         manager.secret.to_file("idp3SigningCertificateText", "/etc/certs/idp-signing.crt")
 
@@ -198,50 +197,113 @@ def main():
     manager.secret.to_file("shibIDP_jks_base64", "/etc/certs/shibIDP.jks",
                            decode=True, binary_mode=True)
 
-    sync_sealer(manager)
 
-    render_idp3_templates(manager)
-    render_salt(manager, "/app/templates/salt.tmpl", "/etc/gluu/conf/salt")
-    render_gluu_properties("/app/templates/gluu.properties.tmpl", "/etc/gluu/conf/gluu.properties")
+def render_base_properties(manager):
+    render_with(render_salt, "/etc/gluu/conf/salt", manager, "/app/templates/salt.tmpl")
+    render_with(render_gluu_properties, "/etc/gluu/conf/gluu.properties", "/app/templates/gluu.properties.tmpl")
 
-    if persistence_type in ("ldap", "hybrid"):
-        render_ldap_properties(
-            manager,
-            "/app/templates/gluu-ldap.properties.tmpl",
-            "/etc/gluu/conf/gluu-ldap.properties",
-        )
-        manager.secret.to_file("ldap_ssl_cert", "/etc/certs/opendj.crt", decode=True)
-        sync_ldap_truststore(manager)
 
-    if persistence_type in ("couchbase", "hybrid"):
-        render_couchbase_properties(
-            manager,
-            "/app/templates/gluu-couchbase.properties.tmpl",
-            "/etc/gluu/conf/gluu-couchbase.properties",
-        )
+def render_ldap_conf(manager):
+    render_with(
+        render_ldap_properties,
+        "/etc/gluu/conf/gluu-ldap.properties",
+        manager,
+        "/app/templates/gluu-ldap.properties.tmpl",
+    )
+    manager.secret.to_file("ldap_ssl_cert", "/etc/certs/opendj.crt", decode=True)
+
+
+def render_couchbase_conf(manager):
+    render_with(
+        render_couchbase_properties,
+        "/etc/gluu/conf/gluu-couchbase.properties",
+        manager,
+        "/app/templates/gluu-couchbase.properties.tmpl",
+    )
+
+
+def sync_couchbase_conf_truststore(manager):
+    if couchbase_truststore_synced(manager):
+        logger.info("Skipped syncing Couchbase truststore; cert is already trusted")
+    else:
         sync_couchbase_truststore(manager)
 
-        if "user" in get_couchbase_mappings(persistence_type, ldap_mapping):
-            saml_couchbase_settings()
+
+def sync_https_cert(manager):
+    if os.path.isfile("/etc/certs/gluu_https.crt"):
+        return
+
+    if as_boolean(os.environ.get("GLUU_SSL_CERT_FROM_SECRETS", False)):
+        manager.secret.to_file("ssl_cert", "/etc/certs/gluu_https.crt")
+    else:
+        get_server_certificate(manager.config.get("hostname"), 443, "/etc/certs/gluu_https.crt")
+
+
+def get_bootstrap_steps(persistence_type, ldap_mapping):
+    """Get bootstrap steps, ordered so they can be run one after another.
+
+    Each step is a tuple of name, callable (which accepts ``manager`` as its argument),
+    and names of the required steps; ``config`` and ``secret`` refer to readiness
+    of config and secrets backends rather than bootstrap steps.
+    """
+    steps = [
+        ("prefetch", lambda manager: prefetch(manager, persistence_type), ["config", "secret"]),
+        ("sync_idp_certs", sync_idp_certs, ["prefetch"]),
+        ("sync_sealer", sync_sealer, ["prefetch"]),
+        ("render_idp3_templates", render_idp3_templates, ["sync_idp_certs"]),
+        ("render_gluu_properties", render_base_properties, ["prefetch"]),
+    ]
+    truststore_requires = ["sync_https_cert"]
+    couchbase_user = False
+
+    if persistence_type in ("ldap", "hybrid"):
+        steps += [
+            ("render_ldap_properties", render_ldap_conf, ["prefetch"]),
+            ("sync_ldap_truststore", sync_ldap_truststore, ["prefetch"]),
+        ]
+        truststore_requires.append("render_ldap_properties")
+
+    if persistence_type in ("couchbase", "hybrid"):
+        steps += [
+            ("render_couchbase_properties", render_couchbase_conf, ["prefetch"]),
+            ("sync_couchbase_truststore", sync_couchbase_conf_truststore, ["prefetch"]),
+        ]
+        couchbase_user = "user" in get_couchbase_mappings(persistence_type, ldap_mapping)
 
     if persistence_type == "hybrid":
-        render_hybrid_properties("/etc/gluu/conf/gluu-hybrid.properties")
-
-    if not os.path.isfile("/etc/certs/gluu_https.crt"):
-        if as_boolean(os.environ.get("GLUU_SSL_CERT_FROM_SECRETS", False)):
-            manager.secret.to_file("ssl_cert", "/etc/certs/gluu_https.crt")
-        else:
-            get_server_certificate(manager.config.get("hostname"), 443, "/etc/certs/gluu_https.crt")
-
-    cert_to_truststore(
-        "gluu_https",
-        "/etc/certs/gluu_https.crt",
-        "/usr/lib/jvm/default-jvm/jre/lib/security/cacerts",
-        "changeit",
-    )
+        steps.append((
+            "render_hybrid_properties",
+            lambda manager: render_with(render_hybrid_properties, "/etc/gluu/conf/gluu-hybrid.properties"),
+            [],
+        ))
+
+    steps += [
+        ("sync_https_cert", sync_https_cert, ["prefetch"]),
+        ("sync_java_truststore", lambda manager: sync_java_truststore(persistence_type), truststore_requires),
+        # patched files (Jetty config and global.xml) are not rendered from templates
+        ("patch_files", lambda manager: patch_files(couchbase_user), []),
+        ("render_jetty_threadpool", lambda manager: render_jetty_threadpool(), []),
+        ("configure_instrumentation", lambda manager: configure_instrumentation(couchbase_user), []),
+    ]
+    return steps
+
+
+def main():
+    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
+    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
+    timer = StepTimer("oxshibboleth_bootstrap_step_duration_seconds")
+
+    with timer.step("get_manager"):
+        manager = get_manager()
+
+    for name, func, _ in get_bootstrap_steps(persistence_type, ldap_mapping):
+        with timer.step(name):
+            func(manager)
 
-    modify_jetty_xml()
-    modify_webdefault_xml()
+    timer.report(logger)
+    textfile = get_textfile_path("oxshibboleth_bootstrap")
+    if textfile:
+        write_textfile(textfile)
 
 
 if __name__ == "__main__":
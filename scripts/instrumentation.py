@@ -0,0 +1,134 @@
+"""Opt-in instrumentation of the IdP (``GLUU_INSTRUMENTATION``).
+
+When enabled, the IdP runs with Prometheus JMX exporter agent, which serves metrics
+at ``http://<container>:<GLUU_INSTRUMENTATION_PORT>/metrics``:
+
+- JVM metrics (heap, GC, threads), exported by the agent itself
+- Jetty threadpool and request timing (Jetty ``jmx`` and ``stats`` modules)
+- active/idle connections of ``siteDataSource`` (Couchbase user persistence), registered
+  as MBean by Spring ``MBeanExporter`` in ``global.xml``
+
+Neither the LDAP pool nor ``siteDataSource`` track checkout wait or per-query latency
+(ldaptive pool is created by the data connector and has no MBean, commons-dbcp 1.x
+only reports pool usage); pool exhaustion shows as active connections reaching the maximum,
+while slow queries show as growing request time with idle Jetty threads.
+"""
+
+import contextlib
+import json
+import logging
+import os
+
+from utils import atomic_write
+
+logger = logging.getLogger("entrypoint")
+
+JMX_EXPORTER_JAR = "/opt/jmx_exporter/jmx_prometheus_javaagent.jar"
+JMX_EXPORTER_CONFIG = "/opt/jmx_exporter/config.yaml"
+JETTY_MODULES_INI = "/opt/gluu/jetty/idp/start.d/instrumentation.ini"
+
+#: Object name of ``siteDataSource`` registered by ``MBeanExporter`` (see ``static/mbean_exporter_bean.xml``).
+DATASOURCE_MBEAN = "oxshibboleth:type=DataSource,name=siteDataSource"
+
+# a tuple of JMX exporter pattern (without attribute), attribute, metric name, type, and labels
+JETTY_RULES = [
+    *[
+        ("org.eclipse.jetty.util.thread<type=queuedthreadpool.*><>", attr, f"oxshibboleth_jetty_threadpool_{name}", "GAUGE", {})
+        for attr, name in [
+            ("threads", "threads"),
+            ("idleThreads", "idle_threads"),
+            ("busyThreads", "busy_threads"),
+            ("readyThreads", "ready_threads"),
+            ("maxThreads", "max_threads"),
+            ("queueSize", "queue_size"),
+        ]
+    ],
+    *[
+        ("org.eclipse.jetty.server.handler<type=statisticshandler.*><>", attr, f"oxshibboleth_jetty_{name}", type_, {})
+        for attr, name, type_ in [
+            ("requests", "requests_total", "COUNTER"),
+            ("requestsActive", "requests_active", "GAUGE"),
+            ("requestTimeMean", "request_time_mean_milliseconds", "GAUGE"),
+            ("requestTimeMax", "request_time_max_milliseconds", "GAUGE"),
+            ("requestTimeStdDev", "request_time_stddev_milliseconds", "GAUGE"),
+            ("dispatchedTimeMean", "dispatched_time_mean_milliseconds", "GAUGE"),
+            ("dispatchedTimeMax", "dispatched_time_max_milliseconds", "GAUGE"),
+            ("responses5xx", "responses_5xx_total", "COUNTER"),
+        ]
+    ],
+]
+
+DATASOURCE_RULES = [
+    ("oxshibboleth<type=DataSource, name=(\\w+)><>", attr, f"oxshibboleth_datasource_{name}", "GAUGE", {"name": "$1"})
+    for attr, name in [
+        ("NumActive", "active_connections"),
+        ("NumIdle", "idle_connections"),
+        ("MaxActive", "max_active_connections"),
+        ("MaxIdle", "max_idle_connections"),
+        ("MaxWait", "max_wait_milliseconds"),
+    ]
+]
+
+
+def is_instrumentation_enabled():
+    return os.environ.get("GLUU_INSTRUMENTATION", "false").lower() in ("true", "1", "yes", "y")
+
+
+def get_instrumentation_port():
+    try:
+        return int(os.environ.get("GLUU_INSTRUMENTATION_PORT", 9404))
+    except ValueError:
+        return 9404
+
+
+def get_exporter_config(couchbase_user=False):
+    """Get config of JMX exporter; only known MBeans are scraped to keep each scrape cheap."""
+    object_names = [
+        "org.eclipse.jetty.util.thread:type=queuedthreadpool,*",
+        "org.eclipse.jetty.server.handler:type=statisticshandler,*",
+    ]
+    rules = list(JETTY_RULES)
+
+    if couchbase_user:
+        object_names.append(DATASOURCE_MBEAN)
+        rules += DATASOURCE_RULES
+
+    return {
+        "startDelaySeconds": 0,
+        "lowercaseOutputName": False,
+        "whitelistObjectNames": object_names,
+        "rules": [
+            # matched against ``domain<properties><>attribute: value``
+            dict({"pattern": f"{pattern}{attr}: ", "name": name, "type": type_}, **({"labels": labels} if labels else {}))
+            for pattern, attr, name, type_, labels in rules
+        ],
+    }
+
+
+def get_instrumentation_options():
+    """Get JVM options to load JMX exporter agent (if instrumentation is enabled)."""
+    if not is_instrumentation_enabled():
+        return []
+    return [f"-javaagent:{JMX_EXPORTER_JAR}={get_instrumentation_port()}:{JMX_EXPORTER_CONFIG}"]
+
+
+def configure_instrumentation(couchbase_user=False):
+    """Render JMX exporter config and enable Jetty modules needed by instrumentation,
+    or disable the modules if instrumentation is disabled.
+    """
+    if not is_instrumentation_enabled():
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(JETTY_MODULES_INI)
+            logger.info("Disabled instrumentation of Jetty")
+        return
+
+    # JSON is valid YAML
+    changed = atomic_write(JMX_EXPORTER_CONFIG, json.dumps(get_exporter_config(couchbase_user), indent=2) + "\n")
+    changed = atomic_write(
+        JETTY_MODULES_INI,
+        "# generated by entrypoint as GLUU_INSTRUMENTATION is enabled\n"
+        "--module=jmx\n"
+        "--module=stats\n",
+    ) or changed
+    if changed:
+        logger.info(f"Enabled instrumentation; metrics are served at port {get_instrumentation_port()}")
@@ -1,51 +1,429 @@
 import contextlib
+import gc
 import glob
+import hashlib
+import itertools
+import json
 import logging.config
 import os
-import shutil
+import random
+import resource
+import sys
+import tempfile
 import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from urllib.parse import unquote
+from urllib.parse import urlsplit
 
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
 from webdav3.client import Client
+from webdav3.client import wrap_connection_error
+from webdav3.exceptions import ConnectionException
 from webdav3.exceptions import RemoteResourceNotFound
-from webdav3.exceptions import NoConnection
+from webdav3.exceptions import WebDavException
+from webdav3.urn import Urn
 
+from blobcache import get_blob_cache
+from blobcache import get_cache_dir
+from metadata import MetadataError
+from metadata import inspect_metadata
+from metadata import is_sp_metadata
+from metadata import update_metadata_index
+from metrics import get_metrics_port
+from metrics import get_textfile_path
+from metrics import registry
+from metrics import start_http_server
+from metrics import write_textfile
 from settings import LOGGING_CONFIG
+from utils import file_digest
+from watch import get_fallback_interval
+from watch import get_watcher
+from watch import is_watch_enabled
 
 ROOT_DIR = "/repository/default"
 SYNC_DIR = "/opt/shibboleth-idp"
 TMP_DIR = "/tmp/webdav"
+MANIFEST_FILE = os.path.join(TMP_DIR, ".manifest.json")
+
+PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<propfind xmlns="DAV:"><prop>'
+    '<resourcetype/><getetag/><getlastmodified/><getcontentlength/>'
+    '</prop></propfind>'
+)
 
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger("webdav")
 
+# a long-lived client (and its underlying HTTP session) shared by all sync cycles
+_client = None
+
+# time of last successful sync cycle (since epoch)
+_last_success_at = None
+
+
+def get_client(url, username, password):
+    """Get WebDAV client that keeps its connections alive between requests
+    (and sync cycles).
+    """
+    global _client
+
+    if _client is None:
+        _client = Client({
+            "webdav_hostname": url,
+            "webdav_login": username,
+            "webdav_password": password,
+            "webdav_root": ROOT_DIR,
+        })
+        _client.verify = False
+
+        # make sure the pool can hold a connection for each worker
+        adapter = HTTPAdapter(pool_maxsize=get_sync_workers())
+        _client.session.mount("http://", adapter)
+        _client.session.mount("https://", adapter)
+    return _client
+
+
+def iter_propfind_responses(response):
+    """Parse ``PROPFIND`` response body while it's being received,
+    yielding each ``DAV:response`` element; the element is discarded afterwards,
+    hence listing of large collection is never held in memory as a whole.
+    """
+    # let urllib3 decompress the body (if compressed)
+    response.raw.decode_content = True
+
+    try:
+        for _, elem in etree.iterparse(
+            response.raw,
+            events=("end",),
+            tag="{DAV:}response",
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        ):
+            yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except HTTPError as exc:
+        # the raw stream is read directly, hence its errors are not wrapped by requests
+        raise ConnectionException(exc)
+    finally:
+        response.close()
+
+
+@wrap_connection_error
+def list_remote_resources(client, path):
+    """Walk remote collection using ``PROPFIND`` requests (``Depth: 1``)
+    and collect properties of every file.
+
+    :returns: A ``dict`` of remote path (relative to ``path``) and its properties.
+    """
+    resources = {}
+    collections = [Urn(path, directory=True).path()]
+
+    while collections:
+        collection = collections.pop()
+        response = client.execute_request(
+            "list",
+            Urn(collection, directory=True).quote(),
+            data=PROPFIND_BODY,
+            headers_ext=["Content-Type: text/xml"],
+        )
+
+        for elem in iter_propfind_responses(response):
+            href = unquote(urlsplit(elem.findtext("{DAV:}href")).path)
+            # strip the WebDAV root, i.e. `/repository/default`
+            href = href[len(client.webdav.root):] if href.startswith(client.webdav.root) else href
+
+            if Urn.normalize_path(href) == Urn.normalize_path(collection):
+                continue
+
+            if elem.find(".//{DAV:}resourcetype/{DAV:}collection") is not None:
+                collections.append(Urn(href, directory=True).path())
+                continue
+
+            relpath = os.path.relpath(href, path)
+            resources[relpath] = {
+                "etag": elem.findtext(".//{DAV:}getetag"),
+                "modified": elem.findtext(".//{DAV:}getlastmodified"),
+                "size": elem.findtext(".//{DAV:}getcontentlength"),
+            }
+    return resources
+
+
+@wrap_connection_error
+def get_remote_fingerprint(client, path):
+    """Get validators of remote collection using ``PROPFIND`` request (``Depth: 0``).
+
+    :returns: A tuple of etag and last-modified of the collection, or ``None``
+              if remote server doesn't provide any of them.
+    """
+    response = client.execute_request(
+        "list",
+        Urn(path, directory=True).quote(),
+        data=PROPFIND_BODY,
+        headers_ext=["Depth: 0", "Content-Type: text/xml"],
+    )
+    tree = etree.fromstring(response.content)
+    fingerprint = (
+        tree.findtext(".//{DAV:}getetag"),
+        tree.findtext(".//{DAV:}getlastmodified"),
+    )
+    if not any(fingerprint):
+        return None
+    return fingerprint
+
+
+@wrap_connection_error
+def download_resource(client, path, local_path, validate=None):
+    """Download remote file and publish it into local path.
+
+    The file is streamed into temporary file in the same directory as
+    ``local_path`` and then moved to ``local_path`` atomically, hence the
+    readers (i.e. Shibboleth reloading its services) never see a partially
+    written file. If downloaded content is identical to existing local file,
+    the latter is kept untouched.
+
+    :param validate: Optional callable to check the downloaded (temporary) file;
+                     if it raises an exception, the local file is kept untouched.
+    :returns: A tuple of number of bytes downloaded, whether local file is replaced,
+              and digest of the content.
+    """
+    response = client.execute_request("download", Urn(path).quote())
+
+    dirname = os.path.dirname(local_path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=f".{os.path.basename(local_path)}.")
+
+    try:
+        size = 0
+        digest = hashlib.sha256()
+
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=get_chunk_size()):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+        if validate:
+            validate(tmp_path)
+
+        if file_digest(local_path) == digest.hexdigest():
+            return size, False, digest.hexdigest()
+
+        # mkstemp creates file readable by owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, local_path)
+        return size, True, digest.hexdigest()
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
 
-def sync_from_webdav(url, username, password):
-    client = Client({
-        "webdav_hostname": url,
-        "webdav_login": username,
-        "webdav_password": password,
-        "webdav_root": ROOT_DIR,
-    })
-    client.verify = False
+
+def get_manifest_file():
+    # keep manifest next to the blobs, so both survive restart
+    cache_dir = get_cache_dir()
+    if cache_dir:
+        return os.path.join(cache_dir, "manifest.json")
+    return MANIFEST_FILE
+
+
+def load_manifest():
+    """Load properties (and digest) of remote files recorded in previous sync."""
+    if get_sync_mode() == "full":
+        return {}
 
     try:
-        logger.info(f"Sync files from {url}{ROOT_DIR}{SYNC_DIR}")
-        # download files to temporary directory to avoid `/opt/shibboleth-idp`
-        # getting deleted
-        client.download(SYNC_DIR, TMP_DIR)
+        with open(get_manifest_file()) as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    manifest_file = get_manifest_file()
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+
+    # the file may be shared with other processes
+    fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(manifest_file), prefix=".manifest.")
+    with os.fdopen(fd, "w") as f:
+        f.write(json.dumps(manifest))
+    os.chmod(tmp_fn, 0o644)
+    os.replace(tmp_fn, manifest_file)
+
+
+def remote_props(entry):
+    """Get remote properties (without digest) of manifest entry."""
+    if not entry:
+        return None
+    return {key: entry.get(key) for key in ("etag", "modified", "size")}
+
+
+def list_local_resources(manifest):
+    """Collect local files (relative to sync directory) that are managed by sync,
+    i.e. files recorded in manifest and TR metadata files.
+    """
+    relpaths = {relpath for relpath in manifest if os.path.isfile(os.path.join(SYNC_DIR, relpath))}
+    relpaths.update(
+        os.path.relpath(path, SYNC_DIR)
+        for path in glob.iglob(os.path.join(SYNC_DIR, "metadata", "*-sp-metadata.xml"))
+    )
+    return relpaths
+
+
+def diff_resources(manifest, resources):
+    """Compare remote resources against local ones.
+
+    :returns: A tuple of resources to add, resources to update, local files to delete,
+              and number of unchanged resources.
+    """
+    local = list_local_resources(manifest)
+    added = {}
+    updated = {}
+    unchanged = 0
+
+    for relpath, props in resources.items():
+        entry = manifest.get(relpath) or {}
+        # rejected file (i.e. expired metadata) is fetched again only once it's changed remotely
+        if entry.get("rejected") and remote_props(entry) == props and (props["etag"] or props["modified"]):
+            unchanged += 1
+        elif relpath not in local:
+            added[relpath] = props
+        # note that resource without any validator (etag/last-modified) is always downloaded
+        elif remote_props(manifest.get(relpath)) != props or not (props["etag"] or props["modified"]):
+            updated[relpath] = props
+        else:
+            unchanged += 1
+
+    deleted = sorted(local.difference(resources))
+    return added, updated, deleted, unchanged
+
+
+def fetch_resource(client, relpath, entry, props, cache=None):
+    """Restore file from cache if remote file is unchanged since it was cached,
+    otherwise download the file (and store it in cache).
+
+    :returns: A tuple of number of bytes downloaded, whether local file is replaced,
+              digest of the content, and whether the file is restored from cache.
+    """
+    local_path = os.path.join(SYNC_DIR, relpath)
+    # malformed or expired TR metadata never reaches the IdP
+    validate = inspect_metadata if is_sp_metadata(relpath) else None
 
-        # copy all downloaded files to /opt/shibboleth-idp
-        for subdir, _, files in os.walk(TMP_DIR):
-            for file_ in files:
-                src = os.path.join(subdir, file_)
-                dest = src.replace(TMP_DIR, SYNC_DIR)
+    digest = (entry or {}).get("digest")
+    # file without any validator (etag/last-modified) may have changed, hence never restored
+    unchanged = remote_props(entry) == props and (props["etag"] or props["modified"])
+    if all([cache, digest, unchanged]):
+        replaced = cache.restore(digest, local_path, validate)
+        if replaced is not None:
+            return 0, replaced, digest, True
 
-                if not os.path.exists(os.path.dirname(dest)):
-                    os.makedirs(os.path.dirname(dest))
-                # logger.info(f"Copying {src} to {dest}")
-                shutil.copyfile(src, dest)
-    except (RemoteResourceNotFound, NoConnection) as exc:
-        logger.warning(f"Unable to sync files from {url}{ROOT_DIR}{SYNC_DIR}; reason={exc}")
+    size, replaced, digest = download_resource(client, local_path, local_path, validate)
+    if cache:
+        cache.put(local_path, digest)
+    return size, replaced, digest, False
+
+
+def iter_completed(executor, func, tasks, limit):
+    """Submit ``func(*args)`` for each ``(key, args)`` of tasks, keeping at most ``limit``
+    tasks in flight (so pending tasks are never queued all at once).
+
+    :returns: An iterator of key and future of each completed task.
+    """
+    tasks = iter(tasks)
+    running = {executor.submit(func, *args): key for key, args in itertools.islice(tasks, limit)}
+
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield running.pop(future), future
+
+            for key, args in itertools.islice(tasks, 1):
+                running[executor.submit(func, *args)] = key
+
+
+def sync_from_webdav(url, username, password):
+    """Reconcile local files against a single snapshot of remote tree.
+
+    New and changed remote files are downloaded, while local files
+    that no longer exist in remote tree are deleted.
+
+    Failure of a single file is logged and counted, and the file is retried on the next cycle.
+
+    :raises RemoteResourceNotFound: If remote tree doesn't exist.
+    :raises NoConnection: If remote server is unreachable.
+    :raises WebDavException: If listing remote tree fails, i.e. server responds with error code.
+    """
+    client = get_client(url, username, password)
+    cache = get_blob_cache()
+    stats = {"files": 0, "bytes": 0, "unchanged": 0, "replaced": 0, "deleted": 0, "rejected": 0, "restored": 0, "errors": 0}
+
+    logger.info(f"Sync files from {url}{ROOT_DIR}{SYNC_DIR}")
+
+    manifest = load_manifest()
+    resources = list_remote_resources(client, SYNC_DIR)
+    added, updated, deleted, stats["unchanged"] = diff_resources(manifest, resources)
+    changed = {**added, **updated}
+
+    for relpath in deleted:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(SYNC_DIR, relpath))
+        stats["deleted"] += 1
+
+    workers = get_sync_workers()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tasks = (
+            (relpath, (client, relpath, manifest.get(relpath), props, cache))
+            for relpath, props in changed.items()
+        )
+
+        for relpath, future in iter_completed(executor, fetch_resource, tasks, workers * 2):
+            try:
+                size, replaced, digest, restored = future.result()
+            except (WebDavException, OSError, etree.Error) as exc:
+                logger.warning(f"Unable to download {relpath}; reason={exc}")
+                record_error(exc)
+                stats["errors"] += 1
+                continue
+            except MetadataError as exc:
+                logger.warning(f"Rejected {relpath}; reason={exc}")
+                stats["rejected"] += 1
+                # local file (if any) is kept, but remember the rejected remote file
+                manifest[relpath] = {**changed[relpath], "rejected": True}
+                continue
+            if restored:
+                # local file identical to the cached blob is neither downloaded nor restored
+                stats["restored"] += int(replaced)
+            else:
+                stats["files"] += 1
+                stats["bytes"] += size
+            stats["replaced"] += int(replaced)
+            manifest[relpath] = {**changed[relpath], "digest": digest}
+
+    # forget resources that no longer exist in remote repository
+    manifest = {relpath: entry for relpath, entry in manifest.items() if relpath in resources}
+    save_manifest(manifest)
+    update_metadata_index()
+
+    if cache and cache.stored:
+        cache.evict({entry.get("digest") for entry in manifest.values()})
+
+    logger.info(
+        f"Downloaded {stats['files']} file(s) ({stats['bytes']} bytes) "
+        f"and replaced {stats['replaced']} local file(s); "
+        f"deleted {stats['deleted']} obsolete local file(s); "
+        f"rejected {stats['rejected']} invalid metadata file(s); "
+        f"restored {stats['restored']} file(s) from cache; "
+        f"failed to fetch {stats['errors']} file(s); "
+        f"{stats['unchanged']} unchanged file(s) skipped; "
+        f"peak memory is {get_peak_rss()} bytes"
+    )
+    return stats
 
 
 def get_jackrabbit_url():
@@ -55,6 +433,7 @@ def get_jackrabbit_url():
 
 
 def get_sync_interval():
+    # deprecated in favor of GLUU_JACKRABBIT_SYNC_INTERVAL_MAX
     default = 5 * 60  # 5 minutes
 
     if "GLUU_JCA_SYNC_INTERVAL" in os.environ:
@@ -69,6 +448,195 @@ def get_sync_interval():
     return interval
 
 
+def get_sync_interval_range():
+    """Get minimum and maximum interval (in seconds) between sync."""
+    try:
+        min_interval = int(os.environ.get("GLUU_JACKRABBIT_SYNC_INTERVAL_MIN", 30))
+    except ValueError:
+        min_interval = 30
+
+    # legacy variables (and their default) are used only if GLUU_JACKRABBIT_SYNC_INTERVAL_MAX is not set
+    try:
+        max_interval = int(os.environ["GLUU_JACKRABBIT_SYNC_INTERVAL_MAX"])
+    except (KeyError, ValueError):
+        max_interval = get_sync_interval()
+
+    min_interval = max(min_interval, 1)
+    return min_interval, max(min_interval, max_interval)
+
+
+class SyncScheduler:
+    """Compute delay between sync cycles.
+
+    The delay is reset to minimum interval right after changes are detected,
+    doubled on each cycle without changes (up to maximum interval), and
+    backed off exponentially (with jitter) on connection failures.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.failures = 0
+        self.fingerprint = None
+        self.last_synced_at = None
+
+    def should_sync(self, fingerprint):
+        """Check whether full sync is needed, i.e. remote fingerprint is unknown or changed,
+        the interval has grown beyond minimum interval, or the last full sync is older than
+        maximum interval.
+
+        Many WebDAV servers don't update validators of a collection when a nested file changes,
+        hence unchanged fingerprint only skips the walk while polling at minimum interval
+        (right after changes); a missed change is picked up by the next cycle.
+        """
+        if fingerprint is None or fingerprint != self.fingerprint or self.last_synced_at is None:
+            return True
+        if self.interval > self.min_interval:
+            return True
+        return time.monotonic() - self.last_synced_at >= self.max_interval
+
+    def record_sync(self, fingerprint, changed):
+        self.fingerprint = fingerprint
+        self.last_synced_at = time.monotonic()
+        self.record_success(changed)
+
+    def record_success(self, changed):
+        self.failures = 0
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def record_failure(self):
+        self.failures += 1
+        self.interval = self.min_interval
+
+    def next_delay(self):
+        if self.failures:
+            ceiling = min(self.min_interval * 2 ** self.failures, self.max_interval)
+            return random.uniform(self.min_interval, ceiling)
+        return self.interval
+
+
+def get_sync_workers():
+    default = 4
+
+    try:
+        workers = int(os.environ.get("GLUU_JACKRABBIT_SYNC_WORKERS", default))
+    except ValueError:
+        workers = default
+    return max(workers, 1)
+
+
+def get_chunk_size():
+    """Get size (in bytes) of each chunk written to disk while downloading a file."""
+    default = 65536
+
+    try:
+        size = int(os.environ.get("GLUU_JACKRABBIT_SYNC_CHUNK_SIZE", default))
+    except ValueError:
+        size = default
+    return max(size, 1024)
+
+
+def get_max_rss():
+    """Get RSS ceiling (in bytes) of sync process; ``0`` means unlimited."""
+    try:
+        max_rss = int(os.environ.get("GLUU_JACKRABBIT_SYNC_MAX_RSS", 0))
+    except ValueError:
+        max_rss = 0
+    return max(max_rss, 0) * 1024 * 1024
+
+
+def get_rss():
+    """Get current resident memory (in bytes) of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def get_peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def enforce_max_rss():
+    """Make sure resident memory is below ``GLUU_JACKRABBIT_SYNC_MAX_RSS``; if it's still above
+    the ceiling after garbage collection, the process is replaced by a fresh one (with the same
+    arguments), as memory freed by Python is not always returned to the OS.
+    """
+    rss = get_rss()
+    registry.set("oxshibboleth_jca_sync_rss_bytes", rss, "Resident memory of sync process in bytes")
+    registry.set("oxshibboleth_jca_sync_peak_rss_bytes", get_peak_rss(), "Peak resident memory of sync process in bytes")
+
+    max_rss = get_max_rss()
+    if not max_rss or rss <= max_rss:
+        return
+
+    gc.collect()
+    rss = get_rss()
+    if rss <= max_rss:
+        return
+
+    try:
+        with open("/proc/self/cmdline", "rb") as f:
+            args = [arg.decode() for arg in f.read().split(b"\0") if arg]
+    except OSError:
+        args = [sys.executable] + sys.argv
+
+    logger.warning(f"Resident memory {rss} bytes exceeds {max_rss} bytes; restarting sync process")
+    logging.shutdown()
+    os.execv(sys.executable, args)
+
+
+def get_sync_mode():
+    mode = os.environ.get("GLUU_JACKRABBIT_SYNC_MODE", "incremental")
+    if mode not in ("incremental", "full"):
+        mode = "incremental"
+    return mode
+
+
+def record_cycle_metrics(duration, result, stats=None):
+    """Record metrics of a single sync cycle."""
+    global _last_success_at
+
+    registry.inc("oxshibboleth_jca_sync_cycles_total", help_="Number of sync cycles", result=result)
+    registry.set("oxshibboleth_jca_sync_cycle_duration_seconds", round(duration, 6), "Duration of last sync cycle in seconds")
+
+    if result in ("synced", "skipped"):
+        _last_success_at = time.time()
+        registry.set(
+            "oxshibboleth_jca_sync_last_success_timestamp_seconds",
+            round(_last_success_at, 3),
+            "Time of last successful sync (or check that found no changes) since epoch",
+        )
+
+    if stats:
+        registry.inc("oxshibboleth_jca_sync_downloaded_files_total", stats["files"], "Number of downloaded files")
+        registry.inc("oxshibboleth_jca_sync_downloaded_bytes_total", stats["bytes"], "Number of downloaded bytes")
+        registry.inc("oxshibboleth_jca_sync_replaced_files_total", stats["replaced"], "Number of replaced local files")
+        registry.inc("oxshibboleth_jca_sync_pruned_files_total", stats["deleted"], "Number of deleted local files")
+        registry.inc("oxshibboleth_jca_sync_rejected_files_total", stats["rejected"], "Number of rejected metadata files")
+        registry.inc("oxshibboleth_jca_sync_restored_files_total", stats["restored"], "Number of files restored from cache")
+
+    textfile = get_textfile_path("oxshibboleth_jca_sync")
+    if textfile:
+        write_textfile(textfile)
+
+
+def record_error(exc):
+    registry.inc("oxshibboleth_jca_sync_errors_total", help_="Number of sync errors", type=type(exc).__name__)
+
+
+def seconds_since_last_success():
+    if _last_success_at is None:
+        return None
+    return round(time.time() - _last_success_at, 3)
+
+
 def main():
     store_type = os.environ.get("GLUU_DOCUMENT_STORE_TYPE", "LOCAL")
     if store_type != "JCA":
@@ -89,45 +657,76 @@ def main():
             password = f.read().strip()
     password = password or username
 
-    sync_interval = get_sync_interval()
-    try:
-        while True:
-            sync_from_webdav(url, username, password)
-            prune_local_tr(url, username, password)
-            time.sleep(sync_interval)
-    except KeyboardInterrupt:
-        logger.warning("Canceled by user; exiting ...")
-
+    client = get_client(url, username, password)
 
-def prune_local_tr(url, username, password):
-    def remote_tr_files(files):
-        for f in files:
-            if f.endswith("-sp-metadata.xml"):
-                yield f
+    watcher = None
+    min_interval, max_interval = get_sync_interval_range()
+    if is_watch_enabled():
+        watcher = get_watcher()
+        # polling is only a fallback in case notifications are missed
+        max_interval = max(get_fallback_interval(max_interval), min_interval)
+    scheduler = SyncScheduler(min_interval, max_interval)
+    notified = False
 
-    client = Client({
-        "webdav_hostname": url,
-        "webdav_login": username,
-        "webdav_password": password,
-        "webdav_root": ROOT_DIR,
-    })
-    client.verify = False
+    registry.set_function(
+        "oxshibboleth_jca_sync_seconds_since_last_success",
+        seconds_since_last_success,
+        "Seconds elapsed since last successful sync (or check that found no changes)",
+    )
+    metrics_port = get_metrics_port()
+    if metrics_port:
+        start_http_server(metrics_port)
 
     try:
-        logger.info("Removing obsolete local TR files (if any)")
+        while True:
+            started_at = time.perf_counter()
+            stats = None
 
-        files = client.list("/opt/shibboleth-idp/metadata")
-        files = tuple(remote_tr_files(files))
+            try:
+                # cheap check before walking the whole remote tree
+                fingerprint = get_remote_fingerprint(client, SYNC_DIR)
 
-        for file_ in glob.iglob("/opt/shibboleth-idp/metadata/*-sp-metadata.xml"):
-            basename = os.path.basename(file_)
-            if basename in files:
-                continue
+                if notified or scheduler.should_sync(fingerprint):
+                    stats = sync_from_webdav(url, username, password)
+                    # files failed to download are retried on next cycle even if remote tree is unchanged
+                    scheduler.record_sync(
+                        None if stats["errors"] else fingerprint,
+                        stats["files"] or stats["deleted"] or stats["restored"],
+                    )
+                    result = "synced"
+                else:
+                    logger.info(f"No changes detected in {url}{ROOT_DIR}{SYNC_DIR}; sync is skipped")
+                    scheduler.record_success(False)
+                    result = "skipped"
+            except Exception as exc:
+                # the sync runs in background for the lifetime of the container, hence must not die
+                if isinstance(exc, (WebDavException, OSError, etree.Error)):
+                    logger.warning(f"Unable to sync files from {url}{ROOT_DIR}{SYNC_DIR}; reason={exc}")
+                else:
+                    logger.exception(f"Unexpected error while syncing files from {url}{ROOT_DIR}{SYNC_DIR}")
+                record_error(exc)
+                result = "failed"
 
-            with contextlib.suppress(FileNotFoundError):
-                os.unlink(file_)
-    except (RemoteResourceNotFound, NoConnection) as exc:
-        logger.warning(f"Unable to get TR files from {url}{ROOT_DIR}{SYNC_DIR}/metadata; reason={exc}")
+                if isinstance(exc, RemoteResourceNotFound):
+                    scheduler.record_success(False)
+                else:
+                    # back off on connection failures, error responses (i.e. 401/5xx), or local errors
+                    scheduler.record_failure()
+
+            record_cycle_metrics(time.perf_counter() - started_at, result, stats)
+            enforce_max_rss()
+
+            if watcher and result != "failed":
+                # sync right after the version key is changed, or when fallback interval has passed
+                notified = watcher.wait(scheduler.max_interval)
+                if notified:
+                    registry.inc("oxshibboleth_jca_sync_notifications_total", help_="Number of change notifications")
+            else:
+                time.sleep(scheduler.next_delay())
+                # retry the notified sync after failure
+                notified = notified and result == "failed"
+    except KeyboardInterrupt:
+        logger.warning("Canceled by user; exiting ...")
 
 
 if __name__ == "__main__":
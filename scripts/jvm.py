@@ -0,0 +1,120 @@
+"""JVM options for GC and heap based on ``GLUU_JVM_PROFILE`` and container limits.
+
+``python3 -m bootstrap start`` builds the command to run the IdP from these options in-process;
+``python3 -m bootstrap jvm-options`` prints them to stdout (i.e. for inspection), while the effective
+options are logged to stderr.
+"""
+
+import logging.config
+import math
+import os
+
+from settings import LOGGING_CONFIG
+from sizing import get_cpu_count
+from sizing import get_memory_limit
+
+logger = logging.getLogger("entrypoint")
+
+PROFILES = ("throughput", "low-latency", "small")
+
+JAVA_PROPERTIES = [
+    "-Dgluu.base=/etc/gluu",
+    "-Dserver.base=/opt/gluu/jetty/idp",
+    "-Dorg.ldaptive.provider=org.ldaptive.provider.unboundid.UnboundIDProvider",
+    "-Dpython.home=/opt/jython",
+]
+
+
+def get_jvm_profile():
+    profile = os.environ.get("GLUU_JVM_PROFILE", "throughput")
+    if profile not in PROFILES:
+        logger.warning(f"Unsupported GLUU_JVM_PROFILE {profile}; using throughput instead")
+        profile = "throughput"
+    return profile
+
+
+def get_max_ram_percentage():
+    try:
+        return float(os.environ.get("GLUU_MAX_RAM_PERCENTAGE", 75.0))
+    except ValueError:
+        return 75.0
+
+
+def get_gc_options(profile, cpus, memory):
+    cores = max(math.ceil(cpus), 1)
+
+    if profile == "low-latency":
+        if os.environ.get("GLUU_JVM_LOW_LATENCY_GC", "g1") == "zgc":
+            # ZGC is experimental in JDK 11
+            return [
+                "-XX:+UnlockExperimentalVMOptions",
+                "-XX:+UseZGC",
+                f"-XX:ConcGCThreads={max(cores // 4, 1)}",
+            ]
+
+        if cores < 2:
+            logger.warning("G1 with less than 2 CPUs may have longer pauses; consider raising CPU limit")
+        return [
+            "-XX:+UseG1GC",
+            "-XX:MaxGCPauseMillis=100",
+            "-XX:+ParallelRefProcEnabled",
+            f"-XX:ParallelGCThreads={cores}",
+            f"-XX:ConcGCThreads={max(cores // 4, 1)}",
+        ]
+
+    if profile == "small":
+        # single-threaded GC and smaller stacks/code cache for constrained containers
+        return [
+            "-XX:+UseSerialGC",
+            "-Xss512k",
+            "-XX:ReservedCodeCacheSize=64m",
+            "-XX:TieredStopAtLevel=1" if memory and memory < 512 else "",
+        ]
+
+    return [
+        "-XX:MaxGCPauseMillis=400",
+        "-XX:+UseParallelGC",
+    ]
+
+
+def get_jvm_options():
+    profile = get_jvm_profile()
+    cpus = get_cpu_count()
+    memory = get_memory_limit()
+    ram_percentage = get_max_ram_percentage()
+
+    options = [opt for opt in get_gc_options(profile, cpus, memory) if opt]
+    options += [
+        "-XX:+DisableExplicitGC",
+        "-XX:+UseContainerSupport",
+        f"-XX:MaxRAMPercentage={ram_percentage}",
+    ]
+
+    logger.info(
+        f"Using JVM profile {profile} for {cpus:g} CPU(s) and {memory} MiB memory "
+        f"(max heap is approximately {int(memory * ram_percentage / 100)} MiB): {' '.join(options)}"
+    )
+    return options
+
+
+def get_java_command(options):
+    """Get command to run the IdP (Jetty) using given JVM options and ``GLUU_JAVA_OPTIONS``."""
+    # GLUU_JAVA_OPTIONS is split on whitespaces, as in shell
+    return [
+        "java",
+        "-server",
+        *options,
+        *JAVA_PROPERTIES,
+        *os.environ.get("GLUU_JAVA_OPTIONS", "").split(),
+        "-jar",
+        "/opt/jetty/start.jar",
+    ]
+
+
+def main():
+    logging.config.dictConfig(LOGGING_CONFIG)
+    print(" ".join(get_jvm_options()))
+
+
+if __name__ == "__main__":
+    main()
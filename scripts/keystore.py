@@ -0,0 +1,522 @@
+"""Minimal reader/writer of Java keystores (JKS and JCEKS) to avoid launching
+``keytool`` (and hence a JVM) during bootstrap.
+"""
+
+import hashlib
+import os
+import ssl
+import struct
+import time
+
+from utils import atomic_write
+
+MAGIC_JKS = 0xFEEDFEED
+MAGIC_JCEKS = 0xCECECECE
+
+TAG_PRIVATE_KEY = 1
+TAG_TRUSTED_CERT = 2
+TAG_SECRET_KEY = 3
+
+# appended to password when calculating keystore digest (as implemented by JDK)
+SIGNATURE_WHITENING = b"Mighty Aphrodite"
+
+# secret keys in JCEKS are stored as serialized ``SealedObjectForKeyProtector`` (as implemented by JDK)
+KEY_PROTECTOR_ALG = "PBEWithMD5AndTripleDES"
+KEY_PROTECTOR_ITERATIONS = 200000
+
+# Java object serialization constants
+STREAM_HEADER = b"\xac\xed\x00\x05"
+TC_NULL = 0x70
+TC_REFERENCE = 0x71
+TC_CLASSDESC = 0x72
+TC_OBJECT = 0x73
+TC_STRING = 0x74
+TC_ARRAY = 0x75
+TC_BLOCKDATA = 0x77
+TC_ENDBLOCKDATA = 0x78
+TC_BLOCKDATALONG = 0x7A
+TC_LONGSTRING = 0x7C
+BASE_HANDLE = 0x7E0000
+SC_WRITE_METHOD = 0x01
+SC_SERIALIZABLE = 0x02
+PRIMITIVE_SIZES = {"B": 1, "C": 2, "D": 8, "F": 4, "I": 4, "J": 8, "S": 2, "Z": 1}
+
+# class descriptors as tuple of name, serialVersionUID, fields (sorted as in JDK), and superclass
+BYTE_ARRAY_CLASS = ("[B", 0xACF317F8060854E0, [], None)
+SECRET_KEY_SPEC_CLASS = (
+    "javax.crypto.spec.SecretKeySpec",
+    0x5B470B66E230614D,
+    [("L", "algorithm", "Ljava/lang/String;"), ("[", "key", "[B")],
+    None,
+)
+SEALED_OBJECT_CLASS = (
+    "javax.crypto.SealedObject",
+    0x3E363DA6C3B75470,
+    [
+        ("[", "encodedParams", "[B"),
+        ("[", "encryptedContent", "[B"),
+        ("L", "paramsAlg", "Ljava/lang/String;"),
+        ("L", "sealAlg", "Ljava/lang/String;"),
+    ],
+    None,
+)
+SEALED_KEY_CLASS = (
+    "com.sun.crypto.provider.SealedObjectForKeyProtector",
+    0xCD57CA59E730BB53,
+    [],
+    SEALED_OBJECT_CLASS,
+)
+
+
+class KeystoreError(Exception):
+    """Raised when keystore is malformed or its integrity check fails."""
+
+
+class UnsupportedKeystoreError(KeystoreError):
+    """Raised when keystore type is neither JKS nor JCEKS (i.e. PKCS12)."""
+
+
+class Entry:
+    """Keystore entry.
+
+    :param tag: Entry type (one of ``TAG_PRIVATE_KEY``, ``TAG_TRUSTED_CERT``, or ``TAG_SECRET_KEY``).
+    :param alias: Entry alias.
+    :param timestamp: Creation time in milliseconds since epoch.
+    :param payload: Raw entry content (after alias and timestamp) as stored in keystore.
+    :param cert: DER-encoded certificate (for trusted certificate entry only).
+    """
+
+    def __init__(self, tag, alias, timestamp, payload, cert=b""):
+        self.tag = tag
+        self.alias = alias
+        self.timestamp = timestamp
+        self.payload = payload
+        self.cert = cert
+
+    @classmethod
+    def trusted_cert(cls, alias, cert):
+        payload = _pack_utf("X.509") + struct.pack(">I", len(cert)) + cert
+        return cls(TAG_TRUSTED_CERT, alias.lower(), int(time.time() * 1000), payload, cert)
+
+    @classmethod
+    def secret_key(cls, alias, key, password, algorithm="AES"):
+        payload = seal_secret_key(key, algorithm, password)
+        return cls(TAG_SECRET_KEY, alias.lower(), int(time.time() * 1000), payload)
+
+    @property
+    def fingerprint(self):
+        if not self.cert:
+            return ""
+        return hashlib.sha256(self.cert).hexdigest()
+
+
+def _pack_utf(text):
+    # surrogateescape keeps non UTF-8 bytes (i.e. Java's modified UTF-8) intact
+    data = text.encode("utf-8", errors="surrogateescape")
+    return struct.pack(">H", len(data)) + data
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size):
+        if self.pos + size > len(self.data):
+            raise KeystoreError("Unexpected end of keystore data")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def read_int(self):
+        return struct.unpack(">I", self.read(4))[0]
+
+    def read_long(self):
+        return struct.unpack(">Q", self.read(8))[0]
+
+    def read_byte(self):
+        return self.read(1)[0]
+
+    def read_utf(self):
+        size = struct.unpack(">H", self.read(2))[0]
+        return self.read(size).decode("utf-8", errors="surrogateescape")
+
+    def read_data(self):
+        return self.read(self.read_int())
+
+
+class _ObjectReader:
+    """Reader of (subset of) Java object serialization stream; objects are
+    returned as ``dict`` of their fields.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.handles = []
+
+    def _assign(self, obj):
+        self.handles.append(obj)
+        return obj
+
+    def read_stream(self):
+        if self.reader.read(4) != STREAM_HEADER:
+            raise KeystoreError("Invalid serialized object stream header")
+        return self.read_content()
+
+    def read_content(self):
+        tc = self.reader.read_byte()
+
+        if tc == TC_NULL:
+            return None
+
+        if tc == TC_REFERENCE:
+            index = self.reader.read_int() - BASE_HANDLE
+            if not 0 <= index < len(self.handles):
+                raise KeystoreError("Invalid reference in serialized object stream")
+            return self.handles[index]
+
+        if tc == TC_STRING:
+            return self._assign(self.reader.read_utf())
+
+        if tc == TC_LONGSTRING:
+            size = self.reader.read_long()
+            return self._assign(self.reader.read(size).decode("utf-8", errors="surrogateescape"))
+
+        if tc == TC_CLASSDESC:
+            return self._read_class_desc()
+
+        if tc == TC_OBJECT:
+            return self._read_object()
+
+        if tc == TC_ARRAY:
+            return self._read_array()
+
+        if tc == TC_BLOCKDATA:
+            return self.reader.read(self.reader.read_byte())
+
+        if tc == TC_BLOCKDATALONG:
+            return self.reader.read(self.reader.read_int())
+
+        if tc == TC_ENDBLOCKDATA:
+            return TC_ENDBLOCKDATA
+
+        raise KeystoreError(f"Unsupported serialized object type code {tc:#x}")
+
+    def _skip_annotations(self):
+        while self.read_content() is not TC_ENDBLOCKDATA:
+            pass
+
+    def _read_class_desc(self):
+        desc = self._assign({"name": self.reader.read_utf()})
+        desc["suid"] = self.reader.read_long()
+        desc["flags"] = self.reader.read_byte()
+
+        desc["fields"] = []
+        for _ in range(struct.unpack(">H", self.reader.read(2))[0]):
+            type_ = chr(self.reader.read_byte())
+            name = self.reader.read_utf()
+            if type_ in ("L", "["):
+                self.read_content()
+            desc["fields"].append((type_, name))
+
+        self._skip_annotations()
+        desc["super"] = self.read_content()
+        return desc
+
+    def _read_value(self, type_):
+        if type_ in PRIMITIVE_SIZES:
+            return self.reader.read(PRIMITIVE_SIZES[type_])
+        return self.read_content()
+
+    def _read_object(self):
+        desc = self.read_content()
+        obj = self._assign({})
+
+        hierarchy = []
+        while desc:
+            hierarchy.insert(0, desc)
+            desc = desc["super"]
+
+        for desc in hierarchy:
+            if not desc["flags"] & SC_SERIALIZABLE:
+                raise KeystoreError(f"Unsupported serialized class {desc['name']}")
+
+            for type_, name in desc["fields"]:
+                obj[name] = self._read_value(type_)
+
+            if desc["flags"] & SC_WRITE_METHOD:
+                self._skip_annotations()
+        return obj
+
+    def _read_array(self):
+        desc = self.read_content()
+        handle = len(self.handles)
+        self._assign(None)
+
+        type_ = desc["name"][1]
+        size = self.reader.read_int()
+        if type_ == "B":
+            array = self.reader.read(size)
+        else:
+            array = [self._read_value(type_) for _ in range(size)]
+
+        self.handles[handle] = array
+        return array
+
+
+class _ObjectWriter:
+    """Writer of (subset of) Java object serialization stream."""
+
+    def __init__(self):
+        self.data = bytearray(STREAM_HEADER)
+        self.handles = {}
+
+    def _assign(self, key):
+        self.handles[key] = len(self.handles)
+
+    def _write_reference(self, key):
+        if key not in self.handles:
+            return False
+        self.data += struct.pack(">BI", TC_REFERENCE, BASE_HANDLE + self.handles[key])
+        return True
+
+    def write_string(self, text):
+        if self._write_reference(("string", text)):
+            return
+        self.data += bytes([TC_STRING]) + _pack_utf(text)
+        self._assign(("string", text))
+
+    def write_class_desc(self, class_):
+        if class_ is None:
+            self.data.append(TC_NULL)
+            return
+
+        name, suid, fields, super_ = class_
+        if self._write_reference(("class", name)):
+            return
+
+        self.data += bytes([TC_CLASSDESC]) + _pack_utf(name)
+        self._assign(("class", name))
+        self.data += struct.pack(">QBH", suid, SC_SERIALIZABLE, len(fields))
+
+        for type_, field_name, field_class in fields:
+            self.data += type_.encode() + _pack_utf(field_name)
+            self.write_string(field_class)
+
+        self.data.append(TC_ENDBLOCKDATA)
+        self.write_class_desc(super_)
+
+    def write_bytes(self, value):
+        self.data.append(TC_ARRAY)
+        self.write_class_desc(BYTE_ARRAY_CLASS)
+        self._assign(("array", len(self.handles)))
+        self.data += struct.pack(">I", len(value)) + value
+
+    def write_object(self, class_, values):
+        """Write object of given class; values are ordered as fields of
+        the top-most superclass down to the class itself.
+        """
+        self.data.append(TC_OBJECT)
+        self.write_class_desc(class_)
+        self._assign(("object", len(self.handles)))
+
+        for value in values:
+            if isinstance(value, bytes):
+                self.write_bytes(value)
+            else:
+                self.write_string(value)
+        return bytes(self.data)
+
+
+def _der_length(size):
+    if size < 0x80:
+        return bytes([size])
+    data = size.to_bytes((size.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(data)]) + data
+
+
+def _pbe_params(salt, iterations):
+    """Encode PBE parameters as DER sequence of salt and iteration count."""
+    count = iterations.to_bytes(iterations.bit_length() // 8 + 1, "big")
+    content = b"\x04" + _der_length(len(salt)) + salt + b"\x02" + _der_length(len(count)) + count
+    return b"\x30" + _der_length(len(content)) + content
+
+
+def _pbe_derive_key(password, salt, iterations):
+    """Derive 3DES key and IV as implemented by JDK's ``PBEWithMD5AndTripleDES``."""
+    halves = [salt[:4], salt[4:]]
+    if halves[0] == halves[1]:
+        # JDK "inverts" the first half incorrectly, which is reproduced here for compatibility
+        half = halves[0]
+        halves[0] = bytes([half[3], half[0], half[1], half[3]])
+
+    password = password.encode("ascii")
+    derived = b""
+    for half in halves:
+        for _ in range(iterations):
+            half = hashlib.md5(half + password).digest()
+        derived += half
+    return derived[:24], derived[24:]
+
+
+def _triple_des():
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+    except ImportError:  # pragma: no cover
+        from cryptography.hazmat.primitives.ciphers.algorithms import TripleDES
+    return TripleDES
+
+
+def seal_secret_key(key, algorithm, password, iterations=KEY_PROTECTOR_ITERATIONS):
+    """Protect secret key using password, in the same format as JDK's JCEKS keystore.
+
+    :returns: Serialized ``SealedObjectForKeyProtector``.
+    """
+    # cryptography is only required for secret keys
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher
+    from cryptography.hazmat.primitives.ciphers import modes
+
+    content = _ObjectWriter().write_object(SECRET_KEY_SPEC_CLASS, [algorithm, key])
+
+    salt = os.urandom(8)
+    des_key, iv = _pbe_derive_key(password, salt, iterations)
+    TripleDES = _triple_des()
+
+    padder = padding.PKCS7(TripleDES.block_size).padder()
+    encryptor = Cipher(TripleDES(des_key), modes.CBC(iv), backend=default_backend()).encryptor()
+    encrypted = encryptor.update(padder.update(content) + padder.finalize()) + encryptor.finalize()
+
+    return _ObjectWriter().write_object(SEALED_KEY_CLASS, [
+        _pbe_params(salt, iterations),
+        encrypted,
+        KEY_PROTECTOR_ALG,
+        KEY_PROTECTOR_ALG,
+    ])
+
+
+def store_digest(password, data):
+    return hashlib.sha1(password.encode("utf-16be") + SIGNATURE_WHITENING + data).digest()
+
+
+def _read_entry_payload(reader, tag):
+    """Read entry content and return DER-encoded certificate (if any)."""
+    if tag == TAG_PRIVATE_KEY:
+        reader.read_data()
+        for _ in range(reader.read_int()):
+            reader.read_utf()
+            reader.read_data()
+        return b""
+
+    if tag == TAG_TRUSTED_CERT:
+        reader.read_utf()
+        return reader.read_data()
+
+    if tag == TAG_SECRET_KEY:
+        # the sealed key is parsed only to find out where the entry ends
+        _ObjectReader(reader).read_stream()
+        return b""
+
+    raise KeystoreError(f"Unexpected keystore entry tag {tag}")
+
+
+def loads(data, password):
+    """Parse keystore.
+
+    :returns: A tuple of keystore magic number and list of :class:`Entry`.
+    """
+    if len(data) < 4 or struct.unpack(">I", data[:4])[0] not in (MAGIC_JKS, MAGIC_JCEKS):
+        raise UnsupportedKeystoreError("Not a JKS or JCEKS keystore")
+
+    reader = _Reader(data)
+    magic = reader.read_int()
+    version = reader.read_int()
+    if version != 2:
+        raise KeystoreError(f"Unsupported keystore version {version}")
+
+    entries = []
+    for _ in range(reader.read_int()):
+        tag = reader.read_int()
+        alias = reader.read_utf()
+        timestamp = reader.read_long()
+
+        start = reader.pos
+        cert = _read_entry_payload(reader, tag)
+        entries.append(Entry(tag, alias, timestamp, data[start:reader.pos], cert))
+
+    if store_digest(password, data[:reader.pos]) != reader.read(20):
+        raise KeystoreError("Keystore integrity check failed; incorrect password?")
+    return magic, entries
+
+
+def dumps(magic, entries, password):
+    data = struct.pack(">III", magic, 2, len(entries))
+    for entry in entries:
+        data += struct.pack(">I", entry.tag) + _pack_utf(entry.alias)
+        data += struct.pack(">Q", entry.timestamp) + entry.payload
+    return data + store_digest(password, data)
+
+
+def load(fn, password):
+    with open(fn, "rb") as f:
+        return loads(f.read(), password)
+
+
+def save(fn, magic, entries, password):
+    # JDK truststore is commonly a symlink (i.e. to /etc/ssl/certs/java/cacerts),
+    # hence write to the actual file instead of replacing the symlink
+    atomic_write(os.path.realpath(fn), dumps(magic, entries, password))
+
+
+def load_cert(fn):
+    """Load the first certificate from PEM file as DER-encoded bytes."""
+    with open(fn) as f:
+        pem = f.read()
+
+    begin = pem.index("-----BEGIN CERTIFICATE-----")
+    end = pem.index("-----END CERTIFICATE-----", begin) + len("-----END CERTIFICATE-----")
+    return ssl.PEM_cert_to_DER_cert(pem[begin:end])
+
+
+def import_trusted_certs(fn, password, certs):
+    """Import certificates into keystore in one pass; certificates which
+    fingerprint already exists in keystore are skipped. Existing entry with
+    the same alias as the imported certificate is replaced.
+
+    :param certs: A ``dict`` of alias and path to PEM-encoded certificate.
+    :returns: List of imported aliases (empty if keystore is unchanged).
+    """
+    magic, entries = load(fn, password)
+    fingerprints = {entry.fingerprint for entry in entries}
+
+    imported = {}
+    for alias, cert_fn in certs.items():
+        entry = Entry.trusted_cert(alias, load_cert(cert_fn))
+        if entry.fingerprint not in fingerprints:
+            imported[entry.alias] = entry
+
+    if not imported:
+        return []
+
+    entries = [entry for entry in entries if entry.alias not in imported]
+    entries.extend(imported.values())
+    save(fn, magic, entries, password)
+    return list(imported)
+
+
+def pkcs12_has_cert(fn, password, cert_fn):
+    """Check whether PKCS12 keystore contains given certificate."""
+    # cryptography is only required by this check
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    with open(fn, "rb") as f:
+        _, cert, extra_certs = pkcs12.load_key_and_certificates(
+            f.read(), password.encode(), default_backend(),
+        )
+
+    der = load_cert(cert_fn)
+    certs = ([cert] if cert else []) + list(extra_certs or [])
+    return any(c.public_bytes(Encoding.DER) == der for c in certs)
@@ -0,0 +1,313 @@
+"""Validate and index SAML metadata of trust relationships (``*-sp-metadata.xml``),
+and optionally combine them into single aggregate file loaded by the IdP.
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from datetime import timezone
+
+from lxml import etree
+
+from utils import atomic_path
+from utils import atomic_write
+from utils import file_digest
+from utils import text_digest
+
+logger = logging.getLogger("webdav")
+
+METADATA_DIR = "/opt/shibboleth-idp/metadata"
+PROVIDERS_FILE = "/opt/shibboleth-idp/conf/metadata-providers.xml"
+INDEX_FILE = "/tmp/webdav/.metadata-index.json"
+
+# must not match ``*-sp-metadata.xml``, as those files are managed by sync
+AGGREGATE_FILE = os.path.join(METADATA_DIR, "sp-metadata-aggregate.xml")
+AGGREGATE_PROVIDER_ID = "SiteAggregateMetadata"
+
+MD_NS = "urn:oasis:names:tc:SAML:2.0:metadata"
+ENTITY_DESCRIPTOR = f"{{{MD_NS}}}EntityDescriptor"
+ENTITIES_DESCRIPTOR = f"{{{MD_NS}}}EntitiesDescriptor"
+
+SHIB_METADATA_NS = "urn:mace:shibboleth:2.0:metadata"
+XSI_TYPE = "{http://www.w3.org/2001/XMLSchema-instance}type"
+
+
+class MetadataError(Exception):
+    """Raised when metadata is malformed or expired."""
+
+
+def _parser():
+    # never fetch external resources (DTD, entities) while parsing untrusted files
+    return etree.XMLParser(
+        resolve_entities=False,
+        no_network=True,
+        load_dtd=False,
+        remove_blank_text=True,
+    )
+
+
+def parse_datetime(value):
+    """Parse ``xs:dateTime`` value as timezone-aware datetime (UTC if timezone is omitted)."""
+    match = re.match(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:\d{2})?$", value.strip())
+    if not match:
+        raise MetadataError(f"Invalid validUntil {value}")
+
+    base, fraction, tz = match.groups()
+    fraction = (fraction or ".0")[1:7].ljust(6, "0")
+    tz = "+00:00" if tz in (None, "Z") else tz
+    return datetime.fromisoformat(f"{base}.{fraction}{tz}")
+
+
+def get_entities(root):
+    if root.tag == ENTITY_DESCRIPTOR:
+        return [root]
+    return list(root.iter(ENTITY_DESCRIPTOR))
+
+
+def inspect_metadata(path, now=None):
+    """Validate metadata file.
+
+    The file is parsed incrementally and processed elements are discarded,
+    hence large aggregates (i.e. federation metadata) don't need to fit in memory.
+
+    :returns: A ``dict`` contains entity IDs and the earliest ``validUntil`` (if any).
+    :raises MetadataError: If metadata is malformed, has no entity, or expired.
+    """
+    now = now or datetime.now(timezone.utc)
+    root = None
+    entity_ids = []
+    valid_until = []
+
+    try:
+        for event, elem in etree.iterparse(
+            path,
+            events=("start", "end"),
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        ):
+            if event == "end":
+                # attributes are read on start; children are no longer needed
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+                continue
+
+            if root is None:
+                root = elem
+                if root.tag not in (ENTITY_DESCRIPTOR, ENTITIES_DESCRIPTOR):
+                    raise MetadataError(f"Unexpected root element {root.tag}")
+
+            if elem is root or elem.tag == ENTITY_DESCRIPTOR:
+                if elem.get("validUntil"):
+                    valid_until.append(parse_datetime(elem.get("validUntil")))
+
+            if elem.tag == ENTITY_DESCRIPTOR:
+                entity_id = elem.get("entityID", "").strip()
+                if not entity_id:
+                    raise MetadataError("Found EntityDescriptor without entityID")
+                entity_ids.append(entity_id)
+    except (etree.XMLSyntaxError, OSError) as exc:
+        raise MetadataError(f"Malformed metadata; reason={exc}")
+
+    if not entity_ids:
+        raise MetadataError("No EntityDescriptor found")
+
+    expires_at = min(valid_until) if valid_until else None
+    if expires_at and expires_at <= now:
+        raise MetadataError(f"Metadata has expired at {expires_at.isoformat()}")
+
+    return {
+        "entity_ids": entity_ids,
+        "valid_until": expires_at.isoformat() if expires_at else "",
+    }
+
+
+def is_sp_metadata(path):
+    return os.path.basename(path).endswith("-sp-metadata.xml")
+
+
+def load_index():
+    try:
+        with open(INDEX_FILE) as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def build_index(previous=None, now=None):
+    """Build index of valid metadata files.
+
+    Files which size and modification time are unchanged since previous index
+    are not parsed again (unless the recorded ``validUntil`` has passed).
+
+    :returns: A ``dict`` of ``files`` (file name and its details) and ``entities``
+              (entity ID and file name).
+    """
+    now = now or datetime.now(timezone.utc)
+    previous_files = (previous or {}).get("files", {})
+    files = {}
+    entities = {}
+
+    for path in sorted(glob.glob(os.path.join(METADATA_DIR, "*-sp-metadata.xml"))):
+        name = os.path.basename(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+
+        entry = previous_files.get(name) or {}
+        fresh = all([
+            entry.get("size") == stat.st_size,
+            entry.get("mtime") == stat.st_mtime_ns,
+            not entry.get("valid_until") or parse_datetime(entry["valid_until"]) > now,
+        ])
+
+        if not fresh:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "digest": file_digest(path)}
+            try:
+                entry.update(inspect_metadata(path, now), error="")
+            except MetadataError as exc:
+                logger.warning(f"Excluding {name} from metadata index; reason={exc}")
+                entry.update(entity_ids=[], valid_until="", error=str(exc))
+        files[name] = entry
+
+        for entity_id in entry["entity_ids"]:
+            if entity_id in entities:
+                logger.warning(f"Duplicate entityID {entity_id} in {name}; using {entities[entity_id]}")
+                continue
+            entities[entity_id] = name
+
+    return {"files": files, "entities": entities}
+
+
+def index_digest(index):
+    """Digest of index content relevant to the aggregate."""
+    files = {
+        name: entry["digest"]
+        for name, entry in index["files"].items()
+        if entry["entity_ids"]
+    }
+    return text_digest(
+        json.dumps(files, sort_keys=True),
+        json.dumps(index["entities"], sort_keys=True),
+        json.dumps(index.get("aggregated", [])),
+    )
+
+
+def write_aggregate(index, path):
+    """Combine valid metadata files into single ``EntitiesDescriptor`` written into ``path``;
+    only files which providers are replaced by the aggregate provider (listed in ``aggregated``
+    key of the index) are included, hence a file without provider is never trusted.
+
+    The aggregate is written incrementally, one metadata file at a time.
+
+    :returns: Whether the file is changed.
+    """
+    aggregated = set(index.get("aggregated", []))
+
+    with atomic_path(path) as result:
+        with etree.xmlfile(result["path"], encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element(ENTITIES_DESCRIPTOR, nsmap={"md": MD_NS}):
+                xf.write("\n", etree.Comment(" generated by oxShibboleth container from *-sp-metadata.xml files "), "\n")
+
+                for name, entry in sorted(index["files"].items()):
+                    entity_ids = [entity_id for entity_id in entry["entity_ids"] if index["entities"].get(entity_id) == name]
+                    if not entity_ids or name not in aggregated:
+                        continue
+
+                    file_root = etree.parse(os.path.join(METADATA_DIR, name), _parser()).getroot()
+                    valid_until = file_root.get("validUntil")
+
+                    for entity in get_entities(file_root):
+                        if entity.get("entityID", "").strip() not in entity_ids:
+                            continue
+                        # keep validity of the parent EntitiesDescriptor, so the IdP still honors it
+                        if valid_until and not entity.get("validUntil"):
+                            entity.set("validUntil", valid_until)
+                        xf.write(entity, pretty_print=True)
+    return result["changed"]
+
+
+def use_aggregate_provider(providers_fn=PROVIDERS_FILE, previous=()):
+    """Replace providers of individual ``*-sp-metadata.xml`` files with single provider
+    of the aggregate file in ``metadata-providers.xml``; providers with their own
+    filters (or other child elements) are kept as-is.
+
+    Once rewritten, the file no longer lists the replaced providers, hence they must be
+    passed as ``previous`` until the file is synced again (i.e. oxTrust adds or removes
+    a trust relationship), which makes its providers authoritative again.
+
+    :param previous: Names of metadata files which providers were replaced earlier.
+    :returns: Names of metadata files which providers are replaced by the aggregate provider.
+    """
+    try:
+        tree = etree.parse(providers_fn, _parser())
+    except (etree.XMLSyntaxError, OSError) as exc:
+        logger.warning(f"Unable to parse {providers_fn}; reason={exc}")
+        return set()
+
+    root = tree.getroot()
+    aggregate = None
+    replaced = set()
+
+    for provider in list(root.iter(f"{{{SHIB_METADATA_NS}}}MetadataProvider")):
+        if provider.get("id") == AGGREGATE_PROVIDER_ID:
+            aggregate = provider
+            continue
+
+        metadata_file = provider.get("metadataFile", "")
+        if not is_sp_metadata(metadata_file):
+            continue
+
+        if not len(provider) and provider.getparent() is not None:
+            replaced.add(os.path.basename(metadata_file))
+            provider.getparent().remove(provider)
+
+    if aggregate is not None:
+        # the file has been rewritten already (not synced since then)
+        replaced.update(previous)
+    else:
+        aggregate = etree.SubElement(root, f"{{{SHIB_METADATA_NS}}}MetadataProvider")
+        aggregate.set("id", AGGREGATE_PROVIDER_ID)
+        aggregate.set(XSI_TYPE, "FilesystemMetadataProvider")
+        aggregate.set("metadataFile", AGGREGATE_FILE)
+
+    content = etree.tostring(tree, xml_declaration=True, encoding="UTF-8", pretty_print=True)
+    if atomic_write(providers_fn, content):
+        logger.info(f"Updated {providers_fn} to load {AGGREGATE_FILE}")
+    return replaced
+
+
+def is_aggregate_enabled():
+    return os.environ.get("GLUU_METADATA_AGGREGATE", "false").lower() in ("true", "1", "yes", "y")
+
+
+def update_metadata_index():
+    """Rebuild metadata index, and the aggregate (if enabled) only when the index is changed.
+
+    :returns: The index.
+    """
+    previous = load_index()
+    index = build_index(previous)
+
+    aggregate_enabled = is_aggregate_enabled()
+    if aggregate_enabled and os.path.isfile(PROVIDERS_FILE):
+        index["aggregated"] = sorted(use_aggregate_provider(PROVIDERS_FILE, previous.get("aggregated", [])))
+    index["digest"] = index_digest(index)
+
+    if index != previous:
+        atomic_write(INDEX_FILE, json.dumps(index, indent=2, sort_keys=True))
+        logger.info(f"Indexed {len(index['entities'])} entity(ies) from {len(index['files'])} metadata file(s)")
+
+    if not aggregate_enabled:
+        return index
+
+    if index["digest"] != previous.get("digest") or not os.path.isfile(AGGREGATE_FILE):
+        if write_aggregate(index, AGGREGATE_FILE):
+            logger.info(f"Updated {AGGREGATE_FILE}")
+    return index
@@ -0,0 +1,170 @@
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger("metrics")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Registry:
+    """Minimal registry of counters and gauges rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = {}
+
+    def _sample(self, name, type_, help_, labels):
+        metric = self._metrics.setdefault(name, {"type": type_, "help": help_, "samples": {}})
+        return metric["samples"], tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, help_="", **labels):
+        """Increase counter by given value."""
+        with self._lock:
+            samples, key = self._sample(name, "counter", help_, labels)
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, help_="", **labels):
+        """Set gauge to given value."""
+        with self._lock:
+            samples, key = self._sample(name, "gauge", help_, labels)
+            samples[key] = value
+
+    def set_function(self, name, func, help_=""):
+        """Register gauge which value is computed by calling ``func`` on each render;
+        the gauge is omitted if ``func`` returns ``None``.
+        """
+        with self._lock:
+            self._callbacks[name] = (func, help_)
+
+    def render(self):
+        lines = []
+
+        with self._lock:
+            metrics = {name: dict(metric, samples=dict(metric["samples"])) for name, metric in self._metrics.items()}
+            callbacks = dict(self._callbacks)
+
+        for name, (func, help_) in callbacks.items():
+            value = func()
+            if value is not None:
+                metrics[name] = {"type": "gauge", "help": help_, "samples": {(): value}}
+
+        for name in sorted(metrics):
+            metric = metrics[name]
+            if metric["help"]:
+                lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in sorted(metric["samples"].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+#: Registry shared by all modules within the same process.
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # avoid noisy access log in container output
+        pass
+
+
+def start_http_server(port, addr=""):
+    """Serve metrics in Prometheus text format in background thread."""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics at http://{addr or '0.0.0.0'}:{port}/metrics")
+    return server
+
+
+def write_textfile(fn):
+    """Write metrics into file consumable by textfile collector (i.e. ``node_exporter``)."""
+    dirname = os.path.dirname(fn)
+    os.makedirs(dirname, exist_ok=True)
+
+    fd, tmp_fn = tempfile.mkstemp(dir=dirname, prefix=f".{os.path.basename(fn)}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(registry.render())
+        os.chmod(tmp_fn, 0o644)
+        os.replace(tmp_fn, fn)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_fn)
+
+
+def get_metrics_port():
+    try:
+        return int(os.environ.get("GLUU_METRICS_PORT", ""))
+    except ValueError:
+        return None
+
+
+def get_textfile_path(name):
+    """Get path to textfile (if textfile output is enabled)."""
+    textfile_dir = os.environ.get("GLUU_METRICS_TEXTFILE_DIR", "")
+    if not textfile_dir:
+        return ""
+    return os.path.join(textfile_dir, f"{name}.prom")
+
+
+class StepTimer:
+    """Measure duration of sequential steps.
+
+    Example:
+
+    .. code-block:: python
+
+        timer = StepTimer("oxshibboleth_bootstrap_step_duration_seconds")
+        with timer.step("render_templates"):
+            render_templates()
+        timer.report(logger)
+    """
+
+    def __init__(self, metric_name):
+        self.metric_name = metric_name
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def step(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            self.durations[name] = self.durations.get(name, 0) + duration
+            registry.set(
+                self.metric_name,
+                round(self.durations[name], 6),
+                "Duration of each step in seconds",
+                step=name,
+            )
+
+    def report(self, logger_):
+        total = sum(self.durations.values())
+        for name, duration in sorted(self.durations.items(), key=lambda item: item[1], reverse=True):
+            logger_.info(f"Step {name} took {duration:.3f}s")
+        logger_.info(f"All steps took {total:.3f}s")
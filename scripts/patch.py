@@ -0,0 +1,349 @@
+"""Declarative and idempotent edits of XML and properties files.
+
+Each file is parsed once, all of its edits are applied, and the file is written
+atomically only if the content is changed. Applying the same edits again is a no-op.
+
+Example:
+
+.. code-block:: python
+
+    patch_file("/opt/jetty/etc/webdefault.xml", [
+        set_text('//d:init-param[d:param-name="dirAllowed"]/d:param-value', "false"),
+    ])
+
+XPath expressions may use ``d`` prefix to refer to the default namespace of the document.
+
+Run ``python3 /app/scripts/patch.py --dry-run`` to print the diff of pending changes
+to Jetty and IdP config files without modifying them.
+"""
+
+import difflib
+import logging.config
+import os
+import re
+import sys
+
+from lxml import etree
+
+from instrumentation import is_instrumentation_enabled
+from settings import LOGGING_CONFIG
+from utils import atomic_write
+
+logger = logging.getLogger("entrypoint")
+
+JETTY_XML = "/opt/jetty/etc/jetty.xml"
+WEBDEFAULT_XML = "/opt/jetty/etc/webdefault.xml"
+GLOBAL_XML = "/opt/shibboleth-idp/conf/global.xml"
+COUCHBASE_BEAN = "/app/static/couchbase_bean.xml"
+MBEAN_EXPORTER_BEAN = "/app/static/mbean_exporter_bean.xml"
+
+
+class PatchError(Exception):
+    """Raised when an edit cannot be applied."""
+
+
+def _parser():
+    # keep the original formatting, and never fetch external DTD/entities
+    return etree.XMLParser(resolve_entities=False, no_network=True, load_dtd=False)
+
+
+def _namespaces(root):
+    default_ns = root.nsmap.get(None)
+    return {"d": default_ns} if default_ns else {}
+
+
+def _xpath(root, expr):
+    return root.xpath(expr, namespaces=_namespaces(root))
+
+
+def _parse_fragment(root, fragment):
+    """Parse XML fragment using namespace declarations of the document root."""
+    nsmap = " ".join(
+        f'xmlns:{prefix}="{uri}"' if prefix else f'xmlns="{uri}"'
+        for prefix, uri in root.nsmap.items()
+    )
+    wrapper = etree.fromstring(f"<patch-fragment {nsmap}>{fragment.strip()}</patch-fragment>", _parser())
+    return wrapper[0]
+
+
+def _remove(elem):
+    """Remove element while keeping the text after it."""
+    parent = elem.getparent()
+    prev = elem.getprevious()
+    if prev is not None:
+        prev.tail = elem.tail if elem.tail and not elem.tail.strip() else prev.tail
+    else:
+        parent.text = elem.tail if elem.tail and not elem.tail.strip() else parent.text
+    parent.remove(elem)
+
+
+def _canonical(elem):
+    return re.sub(r">\s+<", "><", etree.tostring(elem, with_tail=False).decode()).strip()
+
+
+# =========
+# XML edits
+# =========
+
+def set_attribute(xpath, name, value):
+    """Set attribute of every element matched by ``xpath``."""
+    def edit(root):
+        changed = False
+        for elem in _xpath(root, xpath):
+            if elem.get(name) != value:
+                elem.set(name, value)
+                changed = True
+        return changed
+    edit.description = f"set @{name}={value} on {xpath}"
+    return edit
+
+
+def set_text(xpath, text):
+    """Set text of every element matched by ``xpath``."""
+    def edit(root):
+        changed = False
+        for elem in _xpath(root, xpath):
+            if (elem.text or "").strip() != text:
+                elem.text = text
+                changed = True
+        return changed
+    edit.description = f"set text {text} on {xpath}"
+    return edit
+
+
+def ensure_element(parent_xpath, match, fragment):
+    """Make sure each parent matched by ``parent_xpath`` has single child element
+    (matched by relative XPath ``match``) that is equal to ``fragment``;
+    the child is added if missing, or replaced if its content is different.
+    """
+    def edit(root):
+        changed = False
+        for parent in _xpath(root, parent_xpath):
+            new_elem = _parse_fragment(root, fragment)
+            existing = _xpath(parent, match)
+
+            # duplicates (e.g. appended by previous non-idempotent patching) are removed
+            for elem in existing[1:]:
+                _remove(elem)
+                changed = True
+
+            if existing:
+                if _canonical(existing[0]) == _canonical(new_elem):
+                    continue
+                new_elem.tail = existing[0].tail
+                parent.replace(existing[0], new_elem)
+            else:
+                # follow indentation of existing children (if any)
+                if len(parent):
+                    new_elem.tail = parent[-1].tail
+                    parent[-1].tail = parent.text if parent.text and not parent.text.strip() else "\n"
+                else:
+                    # closing tag of the parent follows indentation of its opening tag
+                    prev = parent.getprevious()
+                    indent = prev.tail if prev is not None else getattr(parent.getparent(), "text", None)
+                    new_elem.tail = indent if indent and not indent.strip() else "\n"
+                    parent.text = f"{new_elem.tail}    "
+                parent.append(new_elem)
+            changed = True
+        return changed
+    edit.description = f"ensure {match} in {parent_xpath}"
+    return edit
+
+
+def remove_element(parent_xpath, match):
+    """Remove child elements (matched by relative XPath ``match``) of each parent matched by ``parent_xpath``."""
+    def edit(root):
+        changed = False
+        for parent in _xpath(root, parent_xpath):
+            for elem in _xpath(parent, match):
+                _remove(elem)
+                changed = True
+        return changed
+    edit.description = f"remove {match} from {parent_xpath}"
+    return edit
+
+
+# ================
+# Properties edits
+# ================
+
+def _property_pattern(key):
+    return re.compile(rf"^(\s*{re.escape(key)}\s*[=:]\s*)(.*?)\s*$")
+
+
+def set_property(key, value):
+    """Set value of property; the property is appended if missing."""
+    def edit(lines):
+        pattern = _property_pattern(key)
+        for i, line in enumerate(lines):
+            match = pattern.match(line)
+            if match:
+                if match.group(2) == value:
+                    return False
+                lines[i] = f"{match.group(1)}{value}\n"
+                return True
+        lines.append(f"{key} = {value}\n")
+        return True
+    edit.description = f"set {key}={value}"
+    return edit
+
+
+def ensure_list_item(key, item, separator=", "):
+    """Make sure comma-separated property value contains the item."""
+    def edit(lines):
+        pattern = _property_pattern(key)
+        for i, line in enumerate(lines):
+            match = pattern.match(line)
+            if not match:
+                continue
+
+            items = [value.strip() for value in match.group(2).split(",") if value.strip()]
+            if item in items:
+                return False
+            lines[i] = f"{match.group(1)}{separator.join(items + [item])}\n"
+            return True
+        lines.append(f"{key} = {item}\n")
+        return True
+    edit.description = f"ensure {item} in {key}"
+    return edit
+
+
+# =====
+# Apply
+# =====
+
+# XML declaration, DOCTYPE, comments, and whitespaces before the root element
+PROLOG_RE = re.compile(r"^(?:\s+|<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^\[>]*(?:\[.*?\])?\s*>)*", re.DOTALL)
+
+
+def _patch_xml(txt, edits):
+    root = etree.fromstring(txt.encode(), _parser())
+    changed = [edit.description for edit in edits if edit(root)]
+
+    if not changed:
+        return txt, changed
+
+    # only the root element is serialized, the prolog is kept as-is
+    prolog = PROLOG_RE.match(txt).group(0)
+    content = prolog + etree.tostring(root, encoding="unicode")
+    if txt.endswith("\n") and not content.endswith("\n"):
+        content += "\n"
+    return content, changed
+
+
+def _patch_properties(txt, edits):
+    lines = txt.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    changed = [edit.description for edit in edits if edit(lines)]
+    if not changed:
+        return txt, changed
+    return "".join(lines), changed
+
+
+def patch_file(path, edits, dry_run=False):
+    """Apply edits to XML (``*.xml``) or properties file.
+
+    :param dry_run: If ``True``, the file is not modified.
+    :returns: Unified diff between the original and patched content (empty if unchanged).
+    """
+    with open(path) as f:
+        txt = f.read()
+
+    try:
+        if path.endswith(".xml"):
+            patched, changed = _patch_xml(txt, edits)
+        else:
+            patched, changed = _patch_properties(txt, edits)
+    except (etree.XMLSyntaxError, etree.XPathError) as exc:
+        raise PatchError(f"Unable to patch {path}; reason={exc}")
+
+    if not changed:
+        logger.info(f"Skipped patching {path}; already up-to-date")
+        return ""
+
+    diff = "".join(difflib.unified_diff(
+        txt.splitlines(keepends=True),
+        patched.splitlines(keepends=True),
+        fromfile=path,
+        tofile=f"{path} (patched)",
+    ))
+
+    if dry_run:
+        logger.info(f"Patching {path} would {'; '.join(changed)}")
+    else:
+        atomic_write(path, patched)
+        logger.info(f"Patched {path}: {'; '.join(changed)}")
+    return diff
+
+
+# ===========================
+# Jetty and IdP config files
+# ===========================
+
+def get_file_patches(couchbase_user=False, instrumentation=False):
+    """Get edits of Jetty and IdP config files.
+
+    :param couchbase_user: Whether users are stored in Couchbase (requires ``siteDataSource`` bean).
+    :param instrumentation: Whether ``siteDataSource`` is registered as MBean (see ``instrumentation.py``).
+    :returns: A ``list`` of file path and its edits.
+    """
+    patches = [
+        (JETTY_XML, [
+            # disable contexts
+            ensure_element(
+                '//New[@id="DefaultHandler"]',
+                'Set[@name="showContexts"]',
+                '<Set name="showContexts">false</Set>',
+            ),
+            # disable Jetty version info
+            set_attribute('//Set[@name="sendServerVersion"]/Property', "default", "false"),
+        ]),
+        (WEBDEFAULT_XML, [
+            # disable dirAllowed
+            set_text('//d:init-param[d:param-name="dirAllowed"]/d:param-value', "false"),
+        ]),
+    ]
+
+    if couchbase_user:
+        with open(COUCHBASE_BEAN) as f:
+            bean_xml = f.read()
+
+        exporter_match = 'd:bean[@id="oxshibboleth.MBeanExporter"]'
+        if instrumentation:
+            with open(MBEAN_EXPORTER_BEAN) as f:
+                exporter_edit = ensure_element("/d:beans", exporter_match, f.read())
+        else:
+            exporter_edit = remove_element("/d:beans", exporter_match)
+
+        # note that /conf/datasource.properties is added to idp.properties by its template
+        patches += [
+            (GLOBAL_XML, [ensure_element("/d:beans", 'd:bean[@id="siteDataSource"]', bean_xml), exporter_edit]),
+        ]
+    return patches
+
+
+def has_couchbase_user():
+    from pygluu.containerlib.persistence.couchbase import get_couchbase_mappings
+
+    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
+    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
+    return all([
+        persistence_type in ("couchbase", "hybrid"),
+        "user" in get_couchbase_mappings(persistence_type, ldap_mapping),
+    ])
+
+
+def main():
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    dry_run = "--dry-run" in sys.argv[1:]
+    for path, edits in get_file_patches(has_couchbase_user(), is_instrumentation_enabled()):
+        diff = patch_file(path, edits, dry_run=dry_run)
+        if dry_run:
+            sys.stdout.write(diff)
+
+
+if __name__ == "__main__":
+    main()
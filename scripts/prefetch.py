@@ -0,0 +1,146 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("entrypoint")
+
+# config keys used by bootstrap steps (including helpers from pygluu.containerlib.persistence)
+CONFIG_KEYS = [
+    "hostname",
+    "orgName",
+    "ldap_binddn",
+]
+
+LDAP_CONFIG_KEYS = [
+    "ldapTrustStoreFn",
+]
+
+COUCHBASE_CONFIG_KEYS = [
+    "couchbase_server_user",
+    "couchbaseTrustStoreFn",
+]
+
+# secret keys used by bootstrap steps (including helpers from pygluu.containerlib.persistence)
+SECRET_KEYS = [
+    "encoded_salt",
+    "shibJksPass",
+    "encoded_ox_ldap_pw",
+    "idp3SigningCertificateText",
+    "idp3SigningKeyText",
+    "idp3EncryptionCertificateText",
+    "idp3EncryptionKeyText",
+    "shibIDP_jks_base64",
+    "sealer_jks_base64",
+    "sealer_kver_base64",
+    "ssl_cert",
+]
+
+LDAP_SECRET_KEYS = [
+    "ldap_ssl_cert",
+    "ldap_pkcs12_base64",
+    "encoded_ldapTrustStorePass",
+]
+
+COUCHBASE_SECRET_KEYS = [
+    "couchbase_shib_user_password",
+    "encoded_couchbase_server_pw",
+    "encoded_couchbaseTrustStorePass",
+    "couchbase_truststore_pw",
+]
+
+
+class CachedAdapter:
+    """Adapter that serves values from in-memory snapshot of the actual adapter.
+
+    Keys missing from the snapshot are fetched from the actual adapter
+    (and cached afterwards), while writes are passed through the actual
+    adapter and reflected in the snapshot.
+    """
+
+    def __init__(self, adapter, snapshot):
+        self.adapter = adapter
+        self.snapshot = snapshot
+
+    def get(self, key, default=None):
+        if key not in self.snapshot:
+            self.snapshot[key] = self.adapter.get(key)
+
+        value = self.snapshot[key]
+        if value is None:
+            return default
+        return value
+
+    def set(self, key, value):
+        result = self.adapter.set(key, value)
+        self.snapshot[key] = value
+        return result
+
+    def all(self):
+        return self.adapter.all()
+
+    def __getattr__(self, name):
+        return getattr(self.adapter, name)
+
+
+def fetch_keys(adapter, keys, executor):
+    """Fetch values of given keys concurrently."""
+    futures = {key: executor.submit(adapter.get, key) for key in keys}
+    return {key: future.result() for key, future in futures.items()}
+
+
+def fetch_all(adapter, keys, executor):
+    """Fetch all values in one bulk read; fallback to fetching each key
+    concurrently if adapter doesn't support bulk read.
+    """
+    try:
+        return dict(adapter.all())
+    except (AttributeError, NotImplementedError, TypeError) as exc:
+        logger.warning(f"Unable to fetch all values from {type(adapter).__name__}; reason={exc}")
+        return fetch_keys(adapter, keys, executor)
+
+
+def get_prefetch_keys(persistence_type):
+    """Get config and secret keys needed by bootstrap for given persistence type."""
+    config_keys = list(CONFIG_KEYS)
+    secret_keys = list(SECRET_KEYS)
+
+    if persistence_type in ("ldap", "hybrid"):
+        config_keys += LDAP_CONFIG_KEYS
+        secret_keys += LDAP_SECRET_KEYS
+
+    if persistence_type in ("couchbase", "hybrid"):
+        config_keys += COUCHBASE_CONFIG_KEYS
+        secret_keys += COUCHBASE_SECRET_KEYS
+    return config_keys, secret_keys
+
+
+def prefetch(manager, persistence_type):
+    """Load config and secrets needed by bootstrap into in-memory snapshot.
+
+    Depending on ``GLUU_PREFETCH_MODE``, values are fetched either concurrently
+    per key (``keys``) or in one bulk read per adapter (``bulk``). Afterwards, all
+    reads through ``manager.config`` and ``manager.secret`` are served from the snapshot.
+    """
+    mode = os.environ.get("GLUU_PREFETCH_MODE", "keys")
+    if mode == "off":
+        return manager
+
+    if mode not in ("keys", "bulk"):
+        mode = "keys"
+
+    fetch = fetch_all if mode == "bulk" else fetch_keys
+    config_keys, secret_keys = get_prefetch_keys(persistence_type)
+
+    with ThreadPoolExecutor(max_workers=len(config_keys) + len(secret_keys)) as executor:
+        config = executor.submit(fetch, manager.config.adapter, config_keys, executor)
+        secret = executor.submit(fetch, manager.secret.adapter, secret_keys, executor)
+        config_snapshot, secret_snapshot = config.result(), secret.result()
+
+    manager.config.adapter = CachedAdapter(manager.config.adapter, config_snapshot)
+    manager.secret.adapter = CachedAdapter(manager.secret.adapter, secret_snapshot)
+
+    logger.info(
+        f"Prefetched {len(config_snapshot)} config and {len(secret_snapshot)} secret value(s) "
+        f"using {mode} mode"
+    )
+    return manager
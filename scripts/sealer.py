@@ -0,0 +1,151 @@
+"""Manage Shibboleth data sealer keystore (``sealer.jks``) and version file (``sealer.kver``)
+without launching ``BasicKeystoreKeyStrategyTool`` (and hence a JVM).
+
+Usage:
+
+- ``python3 /app/scripts/sealer.py rotate``: add new sealer key (and remove keys exceeding
+  ``GLUU_SEALER_KEY_COUNT``), then save the files into secrets.
+- ``python3 /app/scripts/sealer.py sync``: pull the files from secrets; Shibboleth reloads
+  the keystore once the version file is changed.
+"""
+
+import logging.config
+import os
+import re
+import sys
+import time
+
+from keystore import KeystoreError
+from keystore import MAGIC_JCEKS
+from keystore import TAG_SECRET_KEY
+from keystore import Entry
+from keystore import load
+from keystore import save
+from settings import LOGGING_CONFIG
+from utils import atomic_path
+from utils import atomic_write
+
+logger = logging.getLogger("entrypoint")
+
+SEALER_JKS = "/opt/shibboleth-idp/credentials/sealer.jks"
+SEALER_KVER = "/opt/shibboleth-idp/credentials/sealer.kver"
+
+# defaults of BasicKeystoreKeyStrategyTool
+SEALER_ALIAS = "secret"
+SEALER_KEY_ALG = "AES"
+SEALER_KEY_SIZE = 128
+
+
+def get_key_count():
+    try:
+        count = int(os.environ.get("GLUU_SEALER_KEY_COUNT", 30))
+    except ValueError:
+        count = 30
+    return max(count, 1)
+
+
+def read_version(kver_fn):
+    """Read current key version from version file (``0`` if file is missing)."""
+    try:
+        with open(kver_fn) as f:
+            txt = f.read()
+    except FileNotFoundError:
+        return 0
+
+    match = re.search(r"^\s*CurrentVersion\s*[=:]\s*(\d+)", txt, flags=re.M)
+    if not match:
+        raise KeystoreError(f"Unable to find CurrentVersion in {kver_fn}")
+    return int(match.group(1))
+
+
+def write_version(kver_fn, version):
+    # mimic java.util.Properties.store format
+    timestamp = time.strftime("%a %b %d %H:%M:%S UTC %Y", time.gmtime())
+    atomic_write(kver_fn, f"#{timestamp}\nCurrentVersion={version}\n")
+
+
+def rotate_sealer(jks_fn, kver_fn, password, key_count=None, alias=SEALER_ALIAS):
+    """Add new sealer key as the current version, and remove the oldest keys
+    so only ``key_count`` keys are kept (same as ``BasicKeystoreKeyStrategyTool``).
+
+    Missing files are created, hence this function also generates the initial sealer.
+
+    :returns: The new key version.
+    """
+    key_count = key_count or get_key_count()
+    version = read_version(kver_fn) + 1
+
+    if os.path.isfile(jks_fn):
+        magic, entries = load(jks_fn, password)
+    else:
+        magic, entries = MAGIC_JCEKS, []
+
+    new_entry = Entry.secret_key(
+        f"{alias}{version}",
+        os.urandom(SEALER_KEY_SIZE // 8),
+        password,
+        algorithm=SEALER_KEY_ALG,
+    )
+    retained = {f"{alias}{v}" for v in range(version - key_count + 1, version)}
+    entries = [
+        entry for entry in entries
+        if entry.tag != TAG_SECRET_KEY or entry.alias in retained
+    ]
+    entries.append(new_entry)
+
+    # keystore must be saved before version file, as the latter triggers reload in IdP
+    save(jks_fn, magic, entries, password)
+    write_version(kver_fn, version)
+
+    logger.info(f"Generated sealer key {new_entry.alias} ({len(entries)} key(s) in {jks_fn})")
+    return version
+
+
+def pull_sealer(manager, jks_fn=SEALER_JKS, kver_fn=SEALER_KVER):
+    """Write sealer files from secrets (if any); files are replaced only when changed.
+
+    :returns: Whether the secrets exist.
+    """
+    if not all([manager.secret.get("sealer_jks_base64"), manager.secret.get("sealer_kver_base64")]):
+        return False
+
+    changed = False
+    # keystore must be replaced before version file, as the latter triggers reload in IdP;
+    # secrets are decoded by the counterpart of ``from_file(..., encode=True)`` used by push_sealer
+    for key, path in [("sealer_jks_base64", jks_fn), ("sealer_kver_base64", kver_fn)]:
+        with atomic_path(path) as result:
+            manager.secret.to_file(key, result["path"], decode=True, binary_mode=True)
+        changed = result["changed"] or changed
+
+    if changed:
+        logger.info(f"Updated {jks_fn} and {kver_fn} from secrets")
+    return True
+
+
+def push_sealer(manager, jks_fn=SEALER_JKS, kver_fn=SEALER_KVER):
+    manager.secret.from_file("sealer_jks_base64", jks_fn, encode=True, binary_mode=True)
+    manager.secret.from_file("sealer_kver_base64", kver_fn, encode=True, binary_mode=True)
+
+
+def main():
+    from pygluu.containerlib import get_manager
+
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("rotate", "sync"):
+        logger.error("Usage: sealer.py rotate|sync")
+        sys.exit(1)
+
+    manager = get_manager()
+
+    # always start from the latest files in secrets, so keys created elsewhere are retained
+    pull_sealer(manager)
+
+    if command == "rotate":
+        rotate_sealer(SEALER_JKS, SEALER_KVER, manager.secret.get("shibJksPass"))
+        push_sealer(manager)
+
+
+if __name__ == "__main__":
+    main()
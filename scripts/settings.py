@@ -27,6 +27,16 @@ LOGGING_CONFIG = {
             "level": "INFO",
             "propagate": False,
         },
+        "entrypoint": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "metrics": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
     # "root": {
     #     "level": "INFO",
@@ -0,0 +1,124 @@
+"""Size connection pools and threadpool based on container's CPU and memory limits."""
+
+import logging
+import math
+import os
+from functools import lru_cache
+
+logger = logging.getLogger("entrypoint")
+
+# cgroup v2 (unified) and v1 files
+CPU_MAX_FILE = "/sys/fs/cgroup/cpu.max"
+CPU_QUOTA_FILE = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CPU_PERIOD_FILE = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+MEMORY_MAX_FILE = "/sys/fs/cgroup/memory.max"
+MEMORY_LIMIT_FILE = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+
+# cgroup v1 reports "unlimited" memory as a huge number (page-aligned LONG_MAX)
+UNLIMITED_MEMORY = 1 << 60
+
+# estimated memory (in MiB) consumed by each connection and thread
+MEMORY_PER_CONNECTION = 32
+MEMORY_PER_THREAD = 4
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def get_cpu_count():
+    """Get number of CPUs available to the container (may be fractional)."""
+    quota, period = "", ""
+
+    cpu_max = _read_file(CPU_MAX_FILE).split()
+    if len(cpu_max) == 2:
+        quota, period = cpu_max
+    else:
+        quota, period = _read_file(CPU_QUOTA_FILE), _read_file(CPU_PERIOD_FILE)
+
+    try:
+        if int(quota) > 0 and int(period) > 0:
+            return int(quota) / int(period)
+    except ValueError:
+        # either "max" (cgroup v2) or missing files
+        pass
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def get_memory_limit():
+    """Get memory available to the container in MiB."""
+    for path in (MEMORY_MAX_FILE, MEMORY_LIMIT_FILE):
+        try:
+            limit = int(_read_file(path))
+        except ValueError:
+            continue
+
+        if 0 < limit < UNLIMITED_MEMORY:
+            return limit // (1024 * 1024)
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError):  # pragma: no cover
+        return 0
+
+
+def _clamp(value, lower, upper):
+    return max(lower, min(value, upper))
+
+
+def _env_int(name, default):
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError:
+        logger.warning(f"Invalid value of {name}; using {default} instead")
+        return default
+    return max(value, 0)
+
+
+@lru_cache(maxsize=None)
+def get_pool_sizes(cpus=None, memory=None):
+    """Calculate sizes of LDAP pool, Couchbase datasource, and Jetty threadpool.
+
+    The values never go below the previous hardcoded defaults (LDAP pool ``3``/``10``,
+    datasource ``10``/``5``, Jetty threadpool ``10``/``200``); each value can be
+    overridden by its environment variable.
+    """
+    cpus = cpus or get_cpu_count()
+    memory = memory or get_memory_limit()
+    cores = max(math.ceil(cpus), 1)
+
+    # connections are mostly waiting on network, hence several per core
+    max_connections = max(memory // MEMORY_PER_CONNECTION, 10) if memory else 64
+    ldap_max = _clamp(cores * 4, 10, min(64, max_connections))
+    ds_max_active = _clamp(cores * 4, 10, min(64, max_connections))
+
+    max_threads = max(memory // MEMORY_PER_THREAD, 200) if memory else 1000
+    jetty_max = _clamp(cores * 50, 200, min(1000, max_threads))
+
+    sizes = {
+        "ldap_pool_min": _env_int("GLUU_LDAP_POOL_MIN", _clamp(cores, 3, ldap_max)),
+        "ldap_pool_max": _env_int("GLUU_LDAP_POOL_MAX", ldap_max),
+        "couchbase_ds_max_active": _env_int("GLUU_COUCHBASE_DS_MAX_ACTIVE", ds_max_active),
+        "couchbase_ds_max_idle": _env_int("GLUU_COUCHBASE_DS_MAX_IDLE", max(ds_max_active // 2, 5)),
+        "couchbase_ds_max_wait": _env_int("GLUU_COUCHBASE_DS_MAX_WAIT", 2000),
+        "jetty_threadpool_min": _env_int("GLUU_JETTY_THREADPOOL_MIN", _clamp(cores * 2, 10, jetty_max)),
+        "jetty_threadpool_max": _env_int("GLUU_JETTY_THREADPOOL_MAX", jetty_max),
+    }
+
+    # pool can't be smaller than its minimum size
+    sizes["ldap_pool_max"] = max(sizes["ldap_pool_max"], sizes["ldap_pool_min"])
+    sizes["jetty_threadpool_max"] = max(sizes["jetty_threadpool_max"], sizes["jetty_threadpool_min"])
+
+    logger.info(
+        f"Sizing for {cpus:g} CPU(s) and {memory} MiB memory: "
+        + ", ".join(f"{k}={v}" for k, v in sizes.items())
+    )
+    return sizes
@@ -0,0 +1,145 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger("entrypoint")
+
+
+def file_digest(path):
+    """Calculate SHA-256 digest of local file (if any)."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return ""
+    return digest.hexdigest()
+
+
+def text_digest(*texts):
+    """Calculate SHA-256 digest of given texts."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode() if isinstance(text, str) else text)
+        # separator to avoid collision between ("ab", "c") and ("a", "bc")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yield a temporary path in the same directory as ``path``;
+    the temporary file is moved to ``path`` only if its content differs
+    from existing file, and is removed afterwards in any case.
+
+    The context value is a ``dict`` with ``path`` key (the temporary path);
+    once the context exits, ``changed`` key tells whether ``path`` is replaced.
+    """
+    # relative path may have no directory part
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or ".", prefix=f".{os.path.basename(path)}.")
+    os.close(fd)
+    result = {"path": tmp_path, "changed": False}
+
+    try:
+        yield result
+
+        if file_digest(tmp_path) != file_digest(path):
+            # mkstemp creates file readable by owner only
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+            result["changed"] = True
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+
+
+def atomic_write(path, content):
+    """Write content to file atomically, but only if the content differs from
+    existing file.
+
+    :returns: Whether the file is changed.
+    """
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with atomic_path(path) as result:
+        with open(result["path"], mode) as f:
+            f.write(content)
+    return result["changed"]
+
+
+class DigestStore:
+    """Persistent mapping of rendered file and digests of its inputs and output."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.digests = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            self.digests = {}
+
+    def is_fresh(self, dest, input_digest):
+        """Check whether ``dest`` was rendered from the same inputs
+        and has not been modified afterwards.
+        """
+        digests = self.digests.get(dest) or {}
+        return all([
+            digests.get("input") == input_digest,
+            digests.get("output") == file_digest(dest),
+        ])
+
+    def update(self, dest, input_digest):
+        self.digests[dest] = {"input": input_digest, "output": file_digest(dest)}
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.digests, indent=2, sort_keys=True))
+
+
+def get_digest_store():
+    return DigestStore(os.environ.get("GLUU_RENDER_DIGEST_FILE", "/deploy/render-digests.json"))
+
+
+def render_template(src, dest, ctx, digest_store, render_func):
+    """Render template into file, unless both template and context are unchanged
+    since previous rendering; the file is written atomically and only when its
+    content is changed.
+
+    :param render_func: Callable to render template text using ``ctx``, i.e. ``safe_render``.
+    :returns: Whether the file is changed.
+    """
+    with open(src) as f:
+        template = f.read()
+
+    input_digest = text_digest(template, json.dumps(ctx, sort_keys=True, default=str))
+    if digest_store.is_fresh(dest, input_digest):
+        logger.info(f"Skipped rendering {dest}; template and context are unchanged")
+        return False
+
+    changed = atomic_write(dest, render_func(template, ctx))
+    digest_store.update(dest, input_digest)
+
+    logger.info(f"Rendered {src} to {dest}" if changed else f"Rendered {src}; {dest} is unchanged")
+    return changed
+
+
+def render_with(func, dest, *args):
+    """Call rendering function (which writes its output to path given as the last argument)
+    against temporary path, then publish the output to ``dest`` only if the content is changed.
+
+    :returns: Whether the file is changed.
+    """
+    with atomic_path(dest) as result:
+        func(*args, result["path"])
+
+    if result["changed"]:
+        logger.info(f"Rendered {dest}")
+    else:
+        logger.info(f"Skipped writing {dest}; content is unchanged")
+    return result["changed"]
@@ -1,26 +1,127 @@
 import logging
 import logging.config
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
 from pygluu.containerlib import get_manager
 from pygluu.containerlib import wait_for
 from pygluu.containerlib.validators import validate_persistence_type
 from pygluu.containerlib.validators import validate_persistence_ldap_mapping
+from pygluu.containerlib.wait import wait_for_config
+from pygluu.containerlib.wait import wait_for_couchbase
+from pygluu.containerlib.wait import wait_for_ldap
+from pygluu.containerlib.wait import wait_for_oxtrust
+from pygluu.containerlib.wait import wait_for_secret
 
+from metrics import get_textfile_path
+from metrics import registry
+from metrics import write_textfile
 from settings import LOGGING_CONFIG
 
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger("wait")
 
+# checks by dependency name; the functions are decorated by ``backoff``
+# (constant interval), hence the undecorated function is used as single probe
+PROBES = {
+    "config": wait_for_config,
+    "secret": wait_for_secret,
+    "ldap": wait_for_ldap,
+    "couchbase": wait_for_couchbase,
+    "oxtrust": wait_for_oxtrust,
+}
 
-def main():
-    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
-    validate_persistence_type(persistence_type)
+# first retry interval (in seconds) in concurrent mode
+INITIAL_INTERVAL = 0.5
 
-    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
-    validate_persistence_ldap_mapping(persistence_type, ldap_mapping)
 
-    manager = get_manager()
+def get_wait_max_time():
+    try:
+        return int(os.environ.get("GLUU_WAIT_MAX_TIME", 300))
+    except ValueError:
+        return 300
+
+
+def get_wait_interval():
+    try:
+        return int(os.environ.get("GLUU_WAIT_SLEEP_DURATION", 10))
+    except ValueError:
+        return 10
+
+
+def get_wait_mode():
+    mode = os.environ.get("GLUU_WAIT_MODE", "concurrent")
+    if mode not in ("concurrent", "serial"):
+        mode = "concurrent"
+    return mode
+
+
+def probe_until_ready(manager, dep, deadline, max_interval):
+    """Probe dependency until it's ready; the retry interval starts from
+    ``INITIAL_INTERVAL`` and doubled after each failed attempt (capped at ``max_interval``).
+
+    :returns: A tuple of elapsed time (in seconds) and number of attempts.
+    """
+    probe = getattr(PROBES[dep], "__wrapped__", PROBES[dep])
+    started_at = time.monotonic()
+    interval = INITIAL_INTERVAL
+    attempts = 0
+
+    while True:
+        attempts += 1
+        try:
+            probe(manager)
+            return time.monotonic() - started_at, attempts
+        except Exception as exc:
+            if time.monotonic() + interval > deadline:
+                raise
+            logger.info(f"Dependency {dep} is not ready yet; reason={exc}; retrying in {interval:.1f}s")
+
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def wait_for_dependency(manager, dep, deadline, max_interval):
+    """Probe dependency until it's ready, then log and record the elapsed time."""
+    elapsed, attempts = probe_until_ready(manager, dep, deadline, max_interval)
+    logger.info(f"Dependency {dep} is ready after {elapsed:.3f}s ({attempts} attempt(s))")
+    registry.set(
+        "oxshibboleth_wait_duration_seconds",
+        round(elapsed, 6),
+        "Time until each dependency is ready in seconds",
+        dependency=dep,
+    )
+
+
+def wait_concurrently(manager, deps):
+    """Probe all dependencies concurrently, and return as soon as all of them are ready.
+
+    :returns: Whether all dependencies are ready.
+    """
+    deadline = time.monotonic() + get_wait_max_time()
+    max_interval = get_wait_interval()
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=len(deps)) as executor:
+        futures = {
+            executor.submit(wait_for_dependency, manager, dep, deadline, max_interval): dep
+            for dep in deps
+        }
+
+        for future in as_completed(futures):
+            dep = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                logger.error(f"Giving up waiting for {dep}; reason={exc}")
+                failed.append(dep)
+    return not failed
+
+
+def get_dependencies(persistence_type):
     deps = ["config", "secret"]
 
     if persistence_type == "hybrid":
@@ -29,7 +130,33 @@ def main():
         deps.append(persistence_type)
 
     # deps.append("oxtrust")
-    wait_for(manager, deps)
+    return deps
+
+
+def main():
+    persistence_type = os.environ.get("GLUU_PERSISTENCE_TYPE", "ldap")
+    validate_persistence_type(persistence_type)
+
+    ldap_mapping = os.environ.get("GLUU_PERSISTENCE_LDAP_MAPPING", "default")
+    validate_persistence_ldap_mapping(persistence_type, ldap_mapping)
+
+    manager = get_manager()
+    deps = get_dependencies(persistence_type)
+
+    if get_wait_mode() == "serial":
+        wait_for(manager, deps)
+        return
+
+    started_at = time.monotonic()
+    ready = wait_concurrently(manager, deps)
+
+    textfile = get_textfile_path("oxshibboleth_wait")
+    if textfile:
+        write_textfile(textfile)
+
+    if not ready:
+        sys.exit(1)
+    logger.info(f"All dependencies are ready after {time.monotonic() - started_at:.3f}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""Watch version key in config backend to trigger sync of trust relationships on changes.
+
+Whoever changes files in Jackrabbit bumps the key, i.e. by running the following command
+in any oxShibboleth container:
+
+.. code-block:: sh
+
+    python3 /app/scripts/watch.py notify
+
+Consul backend is watched using blocking queries (changes are noticed immediately),
+while other backends are polled every ``GLUU_JACKRABBIT_SYNC_WATCH_INTERVAL`` seconds.
+"""
+
+import logging.config
+import os
+import sys
+import time
+
+from settings import LOGGING_CONFIG
+
+logger = logging.getLogger("webdav")
+
+# maximum duration of single Consul blocking query (in seconds)
+BLOCKING_WAIT = 300
+
+
+def is_watch_enabled():
+    return os.environ.get("GLUU_JACKRABBIT_SYNC_WATCH", "false").lower() in ("true", "1", "yes", "y")
+
+
+def get_watch_key():
+    return os.environ.get("GLUU_JACKRABBIT_SYNC_WATCH_KEY", "jackrabbit_sync_version")
+
+
+def get_watch_interval():
+    try:
+        interval = int(os.environ.get("GLUU_JACKRABBIT_SYNC_WATCH_INTERVAL", 5))
+    except ValueError:
+        interval = 5
+    return max(interval, 1)
+
+
+def get_fallback_interval(default):
+    """Get maximum interval between sync while watching; ``default`` is the regular maximum interval,
+    as the version key is only bumped by ``watch.py notify`` (unless another producer is wired up).
+    """
+    try:
+        interval = int(os.environ.get("GLUU_JACKRABBIT_SYNC_WATCH_FALLBACK_INTERVAL", default))
+    except (TypeError, ValueError):
+        interval = default
+    return max(interval, 1)
+
+
+class VersionWatcher:
+    """Wait for changes of version key in config backend."""
+
+    def __init__(self, adapter, key, interval):
+        self.adapter = adapter
+        self.key = key
+        self.interval = interval
+        self.index = None
+
+        # Consul adapter exposes its client; use blocking query instead of polling
+        self.blocking = all([
+            hasattr(getattr(adapter, "client", None), "kv"),
+            hasattr(adapter, "_merge_path"),
+        ])
+        try:
+            self.version = self._read(0)
+        except Exception as exc:
+            # backend may not be ready yet; the first successful read is treated as a change
+            logger.warning(f"Unable to read {key} from config backend; reason={exc}")
+            self.version = None
+
+    def _read(self, wait):
+        if not self.blocking:
+            time.sleep(wait)
+            return self.adapter.get(self.key)
+
+        params = {"index": self.index, "wait": f"{int(wait)}s"} if self.index else {}
+        index, data = self.adapter.client.kv.get(self.adapter._merge_path(self.key), **params)
+
+        # index going backwards means the key is recreated; start over
+        self.index = index if not self.index or int(index) >= int(self.index) else None
+        return data["Value"] if data else None
+
+    def wait(self, timeout):
+        """Block until the version is changed or timeout (in seconds) is reached.
+
+        :returns: Whether the version is changed.
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            wait = min(remaining, BLOCKING_WAIT if self.blocking else self.interval)
+            try:
+                version = self._read(wait)
+            except Exception as exc:
+                logger.warning(f"Unable to read {self.key} from config backend; reason={exc}")
+                time.sleep(min(remaining, self.interval))
+                continue
+
+            if version != self.version:
+                logger.info(f"Detected change of {self.key}")
+                self.version = version
+                return True
+
+
+def get_watcher():
+    """Get watcher of version key in config backend of ``get_manager()``."""
+    from pygluu.containerlib import get_manager
+
+    watcher = VersionWatcher(get_manager().config.adapter, get_watch_key(), get_watch_interval())
+    logger.info(
+        f"Watching {watcher.key} in config backend "
+        f"({'blocking query' if watcher.blocking else f'every {watcher.interval}s'}) to trigger sync"
+    )
+    return watcher
+
+
+def notify_change(manager):
+    """Bump version key, so all watching containers sync their files."""
+    version = str(time.time_ns())
+    manager.config.set(get_watch_key(), version)
+    logger.info(f"Set {get_watch_key()} to {version}")
+    return version
+
+
+def main():
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    if sys.argv[1:] != ["notify"]:
+        logger.error("Usage: watch.py notify")
+        sys.exit(1)
+
+    from pygluu.containerlib import get_manager
+    notify_change(get_manager())
+
+
+if __name__ == "__main__":
+    main()